@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+'''Measures flux_led throughput and latency against emulated bulbs (see
+   bulb_emulator.py), or against real ones with --addr.
+
+   Reports commands per second for streamed colour writes, round trip
+   latency percentiles for state queries on the blocking and asyncio clients,
+   fan-out latency for a BulbGroup, and discovery time. With emulated bulbs it
+   also checks that setting the same timer again sends nothing, and that
+   setting it again after editing it does.'''
+
+import argparse
+import asyncio
+import time
+from bulb_emulator import start_emulators
+from flux_led import BulbGroup, BulbScanner, LedTimer, TimerManager, WifiLedBulb
+from flux_led_aio import AsyncWifiLedBulb
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[int(round(p / 100.0 * (len(ordered) - 1)))]
+
+
+def report(name, samples, count=None, elapsed=None):
+    line = '%-28s' % name
+    if count is not None:
+        line += ' %8.0f/s' % (count / elapsed)
+    if samples:
+        line += '  p50 %6.2f ms  p90 %6.2f ms  p99 %6.2f ms  max %6.2f ms' % tuple(
+            percentile(samples, p) * 1000 for p in (50, 90, 99, 100))
+    print(line)
+
+
+def bench_writes(addr, count):
+    bulb = WifiLedBulb(addr, suppress_writes=False)
+    start = time.time()
+    for i in range(count):
+        bulb.setRgb(i % 256, 0, 0, persist=False)
+    # the writes are only done once the bulb has seen them all
+    bulb.refreshState()
+    report('colour writes', None, count, time.time() - start)
+    bulb.socket.close()
+
+
+def bench_queries(addr, count):
+    bulb = WifiLedBulb(addr)
+    samples = []
+    start = time.time()
+    for i in range(count):
+        sent = time.time()
+        bulb.refreshState()
+        samples.append(time.time() - sent)
+    report('state queries', samples, count, time.time() - start)
+    bulb.socket.close()
+
+
+def bench_async_queries(addr, count):
+    async def run():
+        bulb = AsyncWifiLedBulb(addr)
+        samples = []
+
+        async def query():
+            sent = time.time()
+            await bulb.refreshState()
+            samples.append(time.time() - sent)
+
+        start = time.time()
+        await asyncio.gather(*[query() for i in range(count)])
+        report('pipelined state queries', samples, count, time.time() - start)
+        await bulb.close()
+
+    asyncio.run(run())
+
+
+def bench_group(addrs, count):
+    group = BulbGroup(addrs)
+    group.connect()
+    samples = []
+    bulb_samples = []
+    start = time.time()
+    for i in range(count):
+        sent = time.time()
+        results = group.refreshState()
+        samples.append(time.time() - sent)
+        bulb_samples.extend(result.latency for result in results if result.error is None)
+    report('group of %d, whole call' % len(addrs), samples, count, time.time() - start)
+    report('group of %d, per bulb' % len(addrs), bulb_samples)
+    group.close()
+
+
+def bench_discovery(count, expected):
+    samples = []
+    for i in range(count):
+        scanner = BulbScanner()
+        sent = time.time()
+        found = scanner.scan(timeout=5, expected=expected)
+        samples.append(time.time() - sent)
+    report('discovery (%d found)' % len(found), samples)
+
+
+def check_timer_rewrite(bulbs):
+    '''Sets the same timer twice; the second call must leave the emulated bulbs
+       alone. Then edits that timer and sets it again, which must be sent.'''
+    timer = LedTimer()
+    timer.setActive(True)
+    timer.setTime(10, 30)
+    timer.setRepeatMask(LedTimer.Everyday)
+    timer.setModeTurnOff()
+    group = BulbGroup([bulb.addr for bulb in bulbs])
+    group.connect()
+    manager = TimerManager(group)
+    manager.setTimer(2, timer)
+    commands = [bulb.commands for bulb in bulbs]
+    results = manager.setTimer(2, timer)
+    failures = []
+    for bulb, before, result in zip(bulbs, commands, results):
+        if result.error is not None:
+            failures.append('%s: %s' % (bulb.addr, result.error))
+        elif result.result or bulb.commands != before:
+            failures.append('%s: timers written again' % bulb.addr)
+    timer.setTime(11, 45)
+    for bulb, result in zip(bulbs, manager.setTimer(2, timer)):
+        if result.error is not None:
+            failures.append('%s: %s' % (bulb.addr, result.error))
+        elif not result.result:
+            failures.append('%s: edited timer not written' % bulb.addr)
+    for result in manager.getTimers(refresh=True):
+        if result.error is None and str(result.result[1]) != str(timer):
+            failures.append('%s: slot 2 holds %s' % (result.ipaddr, result.result[1]))
+    group.close()
+    print('%-28s %s' % ('repeated timer', 'FAILED: ' + '; '.join(failures) if failures else 'not rewritten, edit sent'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark flux_led against emulated or real bulbs')
+    parser.add_argument('--addr', action='append', help='bulb address to use instead of emulators, repeatable')
+    parser.add_argument('--bulbs', type=int, default=8, help='number of emulated bulbs')
+    parser.add_argument('--latency', type=float, default=0, help='emulated per command latency, in seconds')
+    parser.add_argument('--loss', type=float, default=0, help='emulated fraction of commands dropped')
+    parser.add_argument('--count', type=int, default=500, help='commands per benchmark')
+    args = parser.parse_args()
+
+    expected = None
+    if args.addr:
+        addrs = args.addr
+    else:
+        bulbs, responder = start_emulators(args.bulbs, latency=args.latency, loss=args.loss)
+        addrs = [bulb.addr for bulb in bulbs]
+        expected = [bulb.bulb_id for bulb in bulbs]
+
+    bench_writes(addrs[0], args.count)
+    bench_queries(addrs[0], args.count)
+    bench_async_queries(addrs[0], args.count)
+    bench_group(addrs, max(args.count // 10, 1))
+    bench_discovery(3, expected)
+    if not args.addr:
+        check_timer_rewrite(bulbs)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+'''Emulates Flux WiFi LED bulbs on this machine, for developing and
+   benchmarking flux_led without the arena bulbs.
+
+   Each bulb listens for commands on TCP 5577 at its own loopback address
+   (127.0.0.1, 127.0.0.2, ...) and all of them answer discovery broadcasts on
+   UDP 48899. Commands with a bad checksum are counted and ignored, like the
+   real bulb. latency delays every command and loss drops that fraction of
+   commands and discovery replies, to imitate a poor Wi-Fi link.'''
+
+import argparse
+import datetime
+import logging
+import random
+import socket
+import threading
+import time
+from flux_led import BulbScanner, LedProtocol, LedTimer
+
+# Message length including checksum, by command code
+message_lengths = {
+    0x10: 12,  # set clock
+    0x11: 5,   # get clock
+    0x21: 88,  # set timers
+    0x22: 5,   # get timers
+    0x31: 8,   # colour / warm white
+    0x41: 8,   # colour / warm white, not persisted
+    0x51: 70,  # custom pattern
+    0x61: 5,   # preset pattern
+    0x71: 4,   # power
+    0x81: 4,   # get state
+}
+
+
+def response(data):
+    return bytes(LedProtocol.addChecksum(bytearray(data)))
+
+
+class BulbEmulator:
+
+    def __init__(self, addr='127.0.0.1', port=5577, bulb_id='ACCF23000001', model='HF-LPB100-ZJ200',
+                 latency=0, loss=0):
+        self.addr = addr
+        self.port = port
+        self.bulb_id = bulb_id
+        self.model = model
+        self.latency = latency
+        self.loss = loss
+        self.lock = threading.Lock()
+
+        self.power = 0x23
+        self.pattern = 0x61
+        self.delay = 0x10
+        self.rgb = (255, 255, 255)
+        self.ww_level = 0
+        self.timers = b''.join(LedTimer().toBytes() for i in range(6))
+        self.clock_offset = datetime.timedelta()
+
+        self.commands = 0
+        self.bad_checksums = 0
+        self.dropped = 0
+        self.running = False
+        self.server = None
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.addr, self.port))
+        self.server.listen(16)
+        self.running = True
+        thread = threading.Thread(target=self.accept_loop)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.running = False
+        self.server.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                connection, peer = self.server.accept()
+            except OSError:
+                break
+            thread = threading.Thread(target=self.serve, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def serve(self, connection):
+        stream = connection.makefile('rb')
+        try:
+            while self.running:
+                code = stream.read(1)
+                if not code:
+                    break
+                length = message_lengths.get(code[0])
+                if length is None:
+                    logging.error('Bulb %s: unknown command 0x%02x' % (self.addr, code[0]))
+                    continue
+                msg = bytearray(code + stream.read(length - 1))
+                if len(msg) < length:
+                    break
+                if self.latency:
+                    time.sleep(self.latency)
+                if random.random() < self.loss:
+                    self.dropped += 1
+                    continue
+                if sum(msg[:-1]) & 0xFF != msg[-1]:
+                    self.bad_checksums += 1
+                    continue
+                self.commands += 1
+                reply = self.handle(msg)
+                if reply:
+                    connection.sendall(reply)
+        except OSError:
+            pass
+        finally:
+            connection.close()
+
+    def handle(self, msg):
+        code = msg[0]
+        with self.lock:
+            if code in (0x31, 0x41):
+                self.pattern = 0x61 if code == 0x31 else 0x62
+                self.rgb = (msg[1], msg[2], msg[3])
+                self.ww_level = msg[4]
+            elif code == 0x51:
+                self.pattern = 0x60
+                self.delay = msg[65]
+            elif code == 0x61:
+                self.pattern = msg[1]
+                self.delay = msg[2]
+            elif code == 0x71:
+                self.power = msg[1]
+            elif code == 0x81:
+                r, g, b = self.rgb
+                return response([0x81, 0x25, self.power, self.pattern, 0x21, self.delay,
+                                 r, g, b, self.ww_level, 0x09, 0x00, 0x00])
+            elif code == 0x21:
+                self.timers = bytes(msg[1:85])
+                return response([0x0f, 0x21, 0xf0])
+            elif code == 0x22:
+                return response(bytearray([0x0f, 0x22]) + self.timers + bytearray([0x00]))
+            elif code == 0x10:
+                bulb_time = datetime.datetime(msg[2] + 2000, msg[3], msg[4], msg[5], msg[6], msg[7])
+                self.clock_offset = bulb_time - datetime.datetime.now()
+            elif code == 0x11:
+                now = datetime.datetime.now() + self.clock_offset
+                return response([0x0f, 0x11, 0x14, now.year - 2000, now.month, now.day,
+                                 now.hour, now.minute, now.second, now.isoweekday(), 0x00])
+        return None
+
+
+class DiscoveryResponder:
+    '''Answers discovery broadcasts on behalf of a set of emulated bulbs'''
+
+    def __init__(self, bulbs, port=BulbScanner.DISCOVERY_PORT, loss=0):
+        self.bulbs = bulbs
+        self.port = port
+        self.loss = loss
+        self.queries = 0
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', self.port))
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.sock.close()
+
+    def run(self):
+        while True:
+            try:
+                data, sender = self.sock.recvfrom(64)
+            except OSError:
+                break
+            if data != BulbScanner.discovery_msg:
+                continue
+            self.queries += 1
+            for bulb in self.bulbs:
+                if random.random() < self.loss:
+                    continue
+                reply = '%s,%s,%s' % (bulb.addr, bulb.bulb_id, bulb.model)
+                self.sock.sendto(reply.encode('ascii'), sender)
+
+
+def start_emulators(count=1, port=5577, latency=0, loss=0, discovery=True):
+    '''Starts count bulbs at 127.0.0.1 upwards; returns (bulbs, responder)'''
+    bulbs = []
+    for i in range(count):
+        bulb = BulbEmulator('127.0.0.%d' % (i + 1), port, bulb_id='ACCF23%06X' % (i + 1),
+                            latency=latency, loss=loss)
+        bulb.start()
+        bulbs.append(bulb)
+    responder = None
+    if discovery:
+        responder = DiscoveryResponder(bulbs, loss=loss)
+        responder.start()
+    return bulbs, responder
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulate Flux WiFi LED bulbs on loopback addresses')
+    parser.add_argument('--count', type=int, default=1, help='number of bulbs, at 127.0.0.1 upwards')
+    parser.add_argument('--port', type=int, default=5577)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every command')
+    parser.add_argument('--loss', type=float, default=0, help='fraction of commands and replies dropped')
+    args = parser.parse_args()
+
+    bulbs, responder = start_emulators(args.count, args.port, args.latency, args.loss)
+    for bulb in bulbs:
+        print('Bulb %s at %s:%d' % (bulb.bulb_id, bulb.addr, bulb.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for bulb in bulbs:
+        print('%s: %d commands, %d bad checksums, %d dropped' % (bulb.addr, bulb.commands, bulb.bad_checksums, bulb.dropped))
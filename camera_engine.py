@@ -0,0 +1,271 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+from subprocess import Popen, PIPE
+
+
+# An encoded JPEG frame. Frames are never modified once created, so the
+# same bytes can be handed to every consumer without copying.
+Frame = namedtuple('Frame', ['sequence', 'timestamp', 'image'])
+
+
+class FrameRing:
+    '''Fixed size ring buffer holding the most recently encoded frames'''
+
+    def __init__(self, size=4):
+        self.condition = threading.Condition()
+        self.frames = deque(maxlen=size)
+        self.sequence = 0
+
+    def push(self, image):
+        with self.condition:
+            self.sequence += 1
+            frame = Frame(self.sequence, time.time(), image)
+            self.frames.append(frame)
+            self.condition.notify_all()
+        return frame
+
+    def latest(self):
+        with self.condition:
+            if self.frames:
+                return self.frames[-1]
+            return None
+
+    def wait_for_newer(self, sequence, timeout):
+        '''Wait up to timeout seconds for a frame other than sequence, then
+           return the latest frame'''
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.sequence == sequence:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.frames[-1]
+
+
+class FrameSubscriber:
+    '''Single slot mailbox for one viewer. A new frame replaces any frame
+       the viewer has not taken yet, so slow viewers skip stale frames
+       instead of building up a backlog.'''
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.closed = False
+        self.dropped = 0
+
+    def offer(self, frame):
+        with self.condition:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.condition.notify()
+
+    def take(self, timeout=None):
+        '''Wait for the next frame. Returns None on timeout or once closed'''
+        with self.condition:
+            if self.frame is None and not self.closed:
+                self.condition.wait(timeout)
+            frame = self.frame
+            self.frame = None
+            return frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+
+class FrameBroadcaster:
+
+    def __init__(self, max_subscribers=8):
+        self.max_subscribers = max_subscribers
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.latest = None
+
+    def subscribe(self):
+        '''Returns a new subscriber primed with the latest frame, or None if
+           there are already max_subscribers viewers'''
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscriber = FrameSubscriber()
+            if self.latest is not None:
+                subscriber.offer(self.latest)
+            self.subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.close()
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, frame):
+        with self.lock:
+            self.latest = frame
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.offer(frame)
+
+
+class StreamFeeder:
+    '''Writes encoded frames to an ffmpeg process on a dedicated thread.
+       Frames wait in a small bounded queue and the oldest are dropped when
+       ffmpeg falls behind, so a stalled stream never blocks the caller.
+       ffmpeg is restarted with exponential backoff whenever it dies, and is
+       killed and restarted when a write takes longer than write_timeout.'''
+
+    def __init__(self, command, max_pending=3, min_backoff=0.5, max_backoff=30, write_timeout=5):
+        self.command = command
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.write_timeout = write_timeout
+        self.condition = threading.Condition()
+        self.pending = deque(maxlen=max_pending)
+        self.process = None
+        self.process_started = 0
+        # When the write in progress began, or None
+        self.write_started = None
+        self.running = False
+        self.thread = None
+        self.watchdog = None
+
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.restarts = 0
+        self.stalls = 0
+        self.last_write_latency = 0.0
+        self.max_write_latency = 0.0
+        self.total_write_latency = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.watchdog = threading.Thread(target=self.watch)
+        self.watchdog.daemon = True
+        self.watchdog.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.kill_process()
+
+    def feed(self, frame):
+        with self.condition:
+            if len(self.pending) == self.pending.maxlen:
+                self.frames_dropped += 1
+            self.pending.append(frame)
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            written = self.frames_written
+            return {
+                'frames_written': written,
+                'frames_dropped': self.frames_dropped,
+                'restarts': self.restarts,
+                'stalls': self.stalls,
+                'last_write_latency': self.last_write_latency,
+                'max_write_latency': self.max_write_latency,
+                'mean_write_latency': self.total_write_latency / written if written else 0.0,
+            }
+
+    def start_process(self):
+        try:
+            process = Popen(self.command, stdin=PIPE)
+        except OSError as e:
+            logging.error('Unable to start ffmpeg: %s' % e)
+            self.process = None
+            return False
+        with self.condition:
+            # stop() may have run while ffmpeg was starting and found no process to kill
+            stopped = not self.running
+            if not stopped:
+                self.process = process
+                self.process_started = time.time()
+        if stopped:
+            process.kill()
+            process.wait()
+            return False
+        return True
+
+    def kill_process(self):
+        with self.condition:
+            process = self.process
+            self.process = None
+        if process is not None and process.poll() is None:
+            try:
+                process.kill()
+                process.wait()
+            except OSError:
+                pass
+
+    def next_frame(self):
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            if not self.running:
+                return None
+            return self.pending.popleft()
+
+    def watch(self):
+        # A stalled ffmpeg blocks the write forever; killing it makes the write fail
+        while self.running:
+            time.sleep(self.write_timeout / 4.0)
+            with self.condition:
+                started = self.write_started
+            if started is not None and time.time() - started > self.write_timeout:
+                logging.error('ffmpeg stream write stalled for %.1fs, restarting' % (time.time() - started))
+                with self.condition:
+                    self.stalls += 1
+                    self.write_started = None
+                self.kill_process()
+
+    def run(self):
+        backoff = self.min_backoff
+        started_once = False
+        while self.running:
+            if self.process is None or self.process.poll() is not None:
+                if started_once:
+                    # Only back off further if ffmpeg keeps dying soon after starting
+                    if time.time() - self.process_started > self.max_backoff:
+                        backoff = self.min_backoff
+                    with self.condition:
+                        self.restarts += 1
+                    time.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                started_once = True
+                if not self.start_process():
+                    continue
+
+            frame = self.next_frame()
+            if frame is None:
+                break
+
+            write_started = time.time()
+            with self.condition:
+                self.write_started = write_started
+            try:
+                self.process.stdin.write(frame.image)
+                self.process.stdin.flush()
+            except (OSError, ValueError, AttributeError) as e:
+                logging.error('ffmpeg stream write failed: %s' % e)
+                self.kill_process()
+                continue
+            finally:
+                with self.condition:
+                    self.write_started = None
+            latency = time.time() - write_started
+
+            with self.condition:
+                self.frames_written += 1
+                self.last_write_latency = latency
+                self.total_write_latency += latency
+                if latency > self.max_write_latency:
+                    self.max_write_latency = latency
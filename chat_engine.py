@@ -1,14 +1,10 @@
 import voice_engine
+import concurrent.futures as futures
 from chatterbot import ChatBot
-from threading import Thread
-import requests
+from unlock_engine import UnlockClient
 
-url = 'https://game.playperception.com/game/attemptunlockround/'
-url_local = 'https://game.localhost/game/attemptunlockround/'
-
-cert_file_path = "certs/client.crt"
-key_file_path = "certs/client.key"
-cert = (cert_file_path, key_file_path)
+unlocked_response = 'Task unlocked'
+incorrect_response = 'Incorrect attempt. Try again.'
 
 keywords = [ 
   'hello',
@@ -38,28 +34,40 @@ chatbot = ChatBot(
     database='presense-chat-database'
 )
 
-def process_speech_input(input):
+# Chatbot lookups and unlock attempts each run on their own workers, so a slow
+# MongoDB query never holds up an unlock attempt or the other way round
+chat_executor = futures.ThreadPoolExecutor(max_workers=1)
+unlock_executor = futures.ThreadPoolExecutor(max_workers=UnlockClient.pool_size)
+unlock_client = UnlockClient()
+
+def is_chat(input):
+  return len(input.split()) > 1 or input in keywords
+
+def chat_response(input):
+  response = chatbot.get_response(input)
+  voice_engine.fspeak(response)
+  return str(response)
 
-  if (len(input.split()) > 1 or input in keywords):
-    voice_engine.mspeak(input)
-    response = chatbot.get_response(input)
-    t = Thread(target=voice_engine.fspeak, args=[response])
-    t.daemon = True
-    t.start()
-    return str(response)
+def attempt_unlock(input):
+  if unlock_client.attempt(input):
+    response = unlocked_response
   else:
-    voice_engine.mspeak(input)
-    r = requests.post(url, json={'attempt': input}, cert=cert, verify=False)
+    response = incorrect_response
+  voice_engine.fspeak(response)
+  return str(response)
+
+def submit_speech_input(input):
+  '''Echoes input and starts the chatbot lookup or unlock attempt for it,
+     returning a future for the response text'''
+  voice_engine.mspeak(input)
+  if is_chat(input):
+    return chat_executor.submit(chat_response, input)
+  return unlock_executor.submit(attempt_unlock, input)
+
+def process_speech_input(input):
+  return submit_speech_input(input).result()
 
-    if (r.status_code is 202 and r.json()['unlocked']):
-      response = 'Task unlocked'
-      t = Thread(target=voice_engine.fspeak, args=[response])
-      t.daemon = True
-      t.start()
-      return str(response)
-    else:
-      response = 'Incorrect attempt. Try again.'
-      t = Thread(target=voice_engine.fspeak, args=[response])
-      t.daemon = True
-      t.start()
-      return str(response)
\ No newline at end of file
+def stop():
+  chat_executor.shutdown(wait=False)
+  unlock_executor.shutdown(wait=False)
+  unlock_client.close()
\ No newline at end of file
@@ -1,19 +1,7 @@
 from chatterbot import ChatBot
 
-chatbot = ChatBot(
-    'The Presence',
-    storage_adapter='chatterbot.storage.MongoDatabaseAdapter',
-    logic_adapters=[
-        'chatterbot.logic.BestMatch'
-    ],
-    filters=[
-        'chatterbot.filters.RepetitiveResponseFilter'
-    ],
-    trainer='chatterbot.trainers.ListTrainer',
-    database='presense-chat-database'
-)
-
-chatbot.train([
+# Alternating prompts and answers, also used to pre-render the answers' speech
+corpus = [
     'Hello',
     'Welcome to Perception',
     'Hello',
@@ -97,4 +85,20 @@ chatbot.train([
     'It\'s not working',
     'Try again. Are you sure the blocks are in the right place? Angle them towards my eyes',
 
-])
+]
+
+if __name__ == '__main__':
+    chatbot = ChatBot(
+        'The Presence',
+        storage_adapter='chatterbot.storage.MongoDatabaseAdapter',
+        logic_adapters=[
+            'chatterbot.logic.BestMatch'
+        ],
+        filters=[
+            'chatterbot.filters.RepetitiveResponseFilter'
+        ],
+        trainer='chatterbot.trainers.ListTrainer',
+        database='presense-chat-database'
+    )
+
+    chatbot.train(corpus)
@@ -11,167 +11,208 @@ import logging
 import threading
 from io import BytesIO
 from PIL import Image, ImageDraw
-from subprocess import Popen, PIPE
 from apscheduler.schedulers.background import BackgroundScheduler
 import pkg_resources
-import requests
 import chat_engine
+import chat_trainer
 import sound_engine
 import voice_engine
+from camera_engine import FrameBroadcaster, FrameRing, StreamFeeder
+from effects_engine import EffectsEngine, MeterEffect, meter_table
 from lights_engine import LightsEngine
-from threading import Timer
+from environment_engine import CHARGING, DANGER, EnvironmentMonitor
+from motor_engine import MotorController, MotorIntent
 from cozmo.util import degrees, distance_mm, speed_mmps
 
 remote_control_cozmo = None
 scheduler = BackgroundScheduler()
-timer = None
 
-cert_file_path = "certs/client.crt"
-key_file_path = "certs/client.key"
-cert = (cert_file_path, key_file_path)
+battery_warning = 'Warning! Battery low. Return to base!'
+
+ffmpeg_command = ['ffmpeg', '-y', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-r', '13', '-i', '-', '-s', '800x450', '-vcodec', 'libx264', '-b:v', '120k', '-r', '13', '-f', 'flv', 'rtmp://192.168.1.108:1935/live/perception']
+
+class RobotVoice:
+    '''Speech scheduler backend for Cozmo's own speaker. Waits up to
+       busy_timeout seconds for the robot to be free, then for the speech to end.
+       stop() gives up waiting as well as aborting the speech.'''
+
+    busy_timeout = 5
+    busy_retry_interval = 0.2
+
+    def __init__(self, coz):
+        self.cozmo = coz
+        # Guards action and stopped, so stop() either sees the action or speak sees stopped
+        self.lock = threading.Lock()
+        self.action = None
+        self.stopped = threading.Event()
+
+    def speak(self, voice, text):
+        self.stopped.clear()
+        deadline = time.time() + self.busy_timeout
+        action = None
+        while not self.stopped.is_set():
+            try:
+                action = self.cozmo.say_text(text, False, False, 1.0, -16.0)
+                break
+            except cozmo.exceptions.RobotBusy:
+                if time.time() > deadline:
+                    logging.error('Robot too busy to say: %s' % text)
+                    return
+                self.stopped.wait(self.busy_retry_interval)
+        if action is None:
+            return
+        with self.lock:
+            self.action = action
+            stopped = self.stopped.is_set()
+        try:
+            if stopped:
+                action.abort()
+            else:
+                action.wait_for_completed()
+        finally:
+            with self.lock:
+                self.action = None
+
+    def stop(self):
+        with self.lock:
+            self.stopped.set()
+            action = self.action
+        if action is not None and action.is_running:
+            action.abort()
 
-url = 'https://www.playperception.com/game/attemptunlockround/'
-url_local = 'https://127.0.0.1/game/attemptunlockround/'
 
 class RemoteControlCozmo:
 
+    # Motor control loop rate, in Hz
+    motor_rate = 20
+    # How often battery and charger state is sampled, in seconds
+    environment_interval = 0.1
+    # Bulbs that show the battery voltage as a live meter, apart from the scene bulbs
+    battery_meter_bulbs = []
+
     def __init__(self, coz):
         self.cozmo = coz
-        self.playing = False  
-        self.charging = False
-        self.danger = False
-        self.battery_update()
+        # Handlers run on several gRPC workers; lock guards the intent and motor state,
+        # action_lock guards the action queue
+        self.lock = threading.RLock()
+        self.action_lock = threading.Lock()
+        self.motor_controller = MotorController(coz, rate=self.motor_rate, recover=self.recover_motors)
         self.lights_engine = LightsEngine()
+        voice_engine.add_backend(voice_engine.ROBOT, RobotVoice(coz))
+        self.environment = EnvironmentMonitor(coz, interval=self.environment_interval)
+        self.environment.add_listener(self.on_environment_change)
+        self.environment.add_warning_listener(self.on_battery_warning)
+        self.effects_engine = None
+        if self.battery_meter_bulbs:
+            self.effects_engine = EffectsEngine(self.battery_meter_bulbs)
+            self.effects_engine.set_effect(MeterEffect(meter_table((255, 0, 0), (0, 255, 0)), self.battery_voltage, 3.5, 4.1))
+            self.effects_engine.start()
         self.reset()
+        self.motor_controller.start()
 
     def reset(self):
-        self.drive_forwards = 0
-        self.drive_back = 0
-        self.turn_left = 0
-        self.turn_right = 0
-        self.lift_up = 0
-        self.lift_down = 0
-        self.head_up = 0
-        self.head_down = 0
-
-        self.go_fast = 0
-        self.go_slow = 0
+        with self.lock:
+            self.drive_forwards = 0
+            self.drive_back = 0
+            self.turn_left = 0
+            self.turn_right = 0
+            self.lift_up = 0
+            self.lift_down = 0
+            self.head_up = 0
+            self.head_down = 0
+
+            self.go_fast = 0
+            self.go_slow = 0
+
+            with self.action_lock:
+                self.action_queue = []
+
+            self.motor_controller.forget()
+            self.update_driving()
 
-        self.action_queue = []
+    def battery_voltage(self):
+        state = self.environment.state
+        if state is None:
+            return None
+        return state.battery_voltage
 
-        self.update_driving()
-        self.update_head()
-        self.update_lift()
+    def on_battery_warning(self, state):
+        # Only queues the line for the speech worker, so it is safe on the environment monitor
+        voice_engine.fspeak(battery_warning, voice_engine.HIGH)
 
-    def battery_update(self):
-        robot = self.cozmo.world.robot
 
-        battery_voltage = round(robot.battery_voltage,2)
-        
-        if battery_voltage < 3.6 and not self.cozmo.is_on_charger:
-            voice_engine.fspeak('Warning! Battery low. Return to base!')
-        else:
-            print('Battery: %s' % battery_voltage)
-        global timer
-        timer = Timer( 20, self.battery_update )
-        timer.start()
-
-
-    def update_environment(self):
-        robot = self.cozmo.world.robot
-        battery_voltage = round(robot.battery_voltage,2)
-
-        if battery_voltage < 3.6 and not self.cozmo.is_on_charger:
-            self.charging = False
-            self.playing = False 
-            if (not self.danger):
-                self.lights_engine.danger()
-                sound_engine.danger()
-                self.danger = True
+    def on_environment_change(self, state, previous):
+        if state.status == DANGER:
+            self.lights_engine.danger()
+            sound_engine.danger()
+        elif state.status == CHARGING:
+            sound_engine.charging()
+            self.lights_engine.charging()
         else:
-            if (self.cozmo.is_on_charger):
-                self.danger = False
-                self.playing = False            
-                if (not self.charging):
-                    sound_engine.charging()
-                    self.lights_engine.charging()
-                    self.charging = True
-            else:
-                self.danger = False
-                self.charging = False
-                if (not self.playing):
-                    self.lights_engine.normal()      
-                    self.playing = True
-                    sound_engine.playing()
+            self.lights_engine.normal()
+            sound_engine.playing()
         
     def handle_key(self, key_code, is_shift_down, is_ctrl_down, is_alt_down, is_key_down):
         '''Called on any key press or release
            Holding a key down may result in repeated handle_key calls with is_key_down==True
         '''
-         # Update desired speed / fidelity of actions based on shift/alt being held
-        was_go_fast = self.go_fast
-        was_go_slow = self.go_slow
-
-        self.go_fast = False
-        self.go_slow = is_alt_down
-
-        speed_changed = (was_go_fast != self.go_fast) or (was_go_slow != self.go_slow)
-
-        # Update state of driving intent from keyboard, and if anything changed then call update_driving
-        update_driving = True
-        if key_code == ord('W'):
-            self.drive_forwards = is_key_down
-        elif key_code == ord('S'):
-            self.drive_back = is_key_down
-        elif key_code == ord('A'):
-            self.turn_left = is_key_down
-        elif key_code == ord('D'):
-            self.turn_right = is_key_down
-        else:
-            if not speed_changed:
-                update_driving = False
-
-        # Update state of lift move intent from keyboard, and if anything changed then call update_lift
-        update_lift = True
-        if key_code == ord('T'):
-            self.lift_up = is_key_down
-        elif key_code == ord('G'):
-            self.lift_down = is_key_down
-        else:
-            if not speed_changed:
-                update_lift = False
-
-        # Update state of head move intent from keyboard, and if anything changed then call update_head
-        update_head = True
-        if key_code == ord('R'):
-            self.head_up = is_key_down
-        elif key_code == ord('F'):
-            self.head_down = is_key_down
-        else:
-            if not speed_changed:
-                update_head = False
+        with self.lock:
+             # Update desired speed / fidelity of actions based on shift/alt being held
+            was_go_fast = self.go_fast
+            was_go_slow = self.go_slow
+
+            self.go_fast = False
+            self.go_slow = is_alt_down
+
+            speed_changed = (was_go_fast != self.go_fast) or (was_go_slow != self.go_slow)
+
+            # Update state of driving intent from keyboard, and if anything changed then call update_driving
+            update_driving = True
+            if key_code == ord('W'):
+                self.drive_forwards = is_key_down
+            elif key_code == ord('S'):
+                self.drive_back = is_key_down
+            elif key_code == ord('A'):
+                self.turn_left = is_key_down
+            elif key_code == ord('D'):
+                self.turn_right = is_key_down
+            else:
+                if not speed_changed:
+                    update_driving = False
+
+            # Update state of lift move intent from keyboard, and if anything changed then call update_lift
+            update_lift = True
+            if key_code == ord('T'):
+                self.lift_up = is_key_down
+            elif key_code == ord('G'):
+                self.lift_down = is_key_down
+            else:
+                if not speed_changed:
+                    update_lift = False
+
+            # Update state of head move intent from keyboard, and if anything changed then call update_head
+            update_head = True
+            if key_code == ord('R'):
+                self.head_up = is_key_down
+            elif key_code == ord('F'):
+                self.head_down = is_key_down
+            else:
+                if not speed_changed:
+                    update_head = False
 
-        # Update driving, head and lift as appropriate
-        if update_driving:
-            self.update_driving()
-        if update_head:
-            self.update_head()
-        if update_lift:
-            self.update_lift()
+            # Update driving, head and lift intent as appropriate. The motor control
+            # loop sends any resulting change to the robot on its next tick
+            if update_driving:
+                self.update_driving()
+            elif update_head or update_lift:
+                self.update_motors()
 
 
     def queue_action(self, new_action):
-        if len(self.action_queue) > 10:
-            self.action_queue.pop(0)
-        self.action_queue.append(new_action)
-
-
-    def try_say_text(self, text_to_say):
-        try:
-            self.cozmo.say_text(text_to_say, False, False, 1.0, -16.0)
-            return True
-        except cozmo.exceptions.RobotBusy:
-            return False
+        with self.action_lock:
+            if len(self.action_queue) > 10:
+                self.action_queue.pop(0)
+            self.action_queue.append(new_action)
 
 
     def try_play_anim(self, anim_name):
@@ -183,8 +224,7 @@ class RemoteControlCozmo:
 
 
     def say_text(self, text_to_say):
-        self.queue_action((self.try_say_text, text_to_say))
-        self.update()
+        voice_engine.speak(voice_engine.ROBOT, text_to_say)
 
 
     def play_animation(self, anim_name):
@@ -194,10 +234,11 @@ class RemoteControlCozmo:
 
     def update(self):
         '''Try and execute the next queued action'''
-        if len(self.action_queue) > 0:
-            queued_action, action_args = self.action_queue[0]
-            if queued_action(action_args):
-                self.action_queue.pop(0)
+        with self.action_lock:
+            if len(self.action_queue) > 0:
+                queued_action, action_args = self.action_queue[0]
+                if queued_action(action_args):
+                    self.action_queue.pop(0)
 
 
     def pick_speed(self, fast_speed, mid_speed, slow_speed):
@@ -209,49 +250,61 @@ class RemoteControlCozmo:
         return mid_speed
 
 
-    def update_lift(self):
+    def motor_intent(self):
         lift_speed = self.pick_speed(8, 4, 2)
         lift_vel = (self.lift_up - self.lift_down) * lift_speed
-        self.cozmo.move_lift(lift_vel)
-
 
-    def update_head(self):
         head_speed = self.pick_speed(2, 1, 0.5)
         head_vel = (self.head_up - self.head_down) * head_speed
-        self.cozmo.move_head(head_vel)
+
+        drive_dir = (self.drive_forwards - self.drive_back)
+        turn_dir = (self.turn_right - self.turn_left)
+
+        if drive_dir < 0:
+            # It feels more natural to turn the opposite way when reversing
+            turn_dir = -turn_dir
+
+        forward_speed = self.pick_speed(100, 50, 30)
+        turn_speed = self.pick_speed(100, 50, 30)
+
+        l_wheel_speed = (drive_dir * forward_speed) + (turn_speed * turn_dir)
+        r_wheel_speed = (drive_dir * forward_speed) - (turn_speed * turn_dir)
+
+        return MotorIntent(l_wheel_speed, r_wheel_speed, head_vel, lift_vel)
+
+
+    def update_motors(self):
+        self.motor_controller.set_intent(self.motor_intent())
 
 
     def update_driving(self):
+        self.motor_controller.set_intent(self.motor_intent(), driving_changed=True)
+
+
+    def recover_motors(self, intent):
+        '''Runs on the motor control loop whenever the driving intent changes.
+           Returns True if it moved the motors itself'''
+        moved = False
 
         if (self.cozmo.gyro.y < -5):
             self.cozmo.drive_wheels(-3000, -3000, -3000*4, -3000*4, duration=0.2)
             self.cozmo.set_lift_height(1,1,1,0.01).wait_for_completed()
             self.cozmo.drive_wheels(3000, 3000, 3000*4, 3000*4, duration=0.2)
             self.cozmo.set_lift_height(0,0,0,0.01).wait_for_completed()
+            moved = True
 
-        drive_dir = (self.drive_forwards - self.drive_back)
+        driving_forwards = (intent.l_wheel_speed + intent.r_wheel_speed) > 0
 
-        if (drive_dir > 0.1) and self.cozmo.is_on_charger:
+        if driving_forwards and self.cozmo.is_on_charger:
             # cozmo is stuck on the charger, and user is trying to drive off - issue an explicit drive off action
             try:
                 self.cozmo.drive_off_charger_contacts().wait_for_completed()
+                moved = True
             except cozmo.exceptions.RobotBusy:
                 # Robot is busy doing another action - try again next time we get a drive impulse
                 pass
 
-        turn_dir = (self.turn_right - self.turn_left)
-
-        if drive_dir < 0:
-            # It feels more natural to turn the opposite way when reversing
-            turn_dir = -turn_dir
-
-        forward_speed = self.pick_speed(100, 50, 30)
-        turn_speed = self.pick_speed(100, 50, 30)
-
-        l_wheel_speed = (drive_dir * forward_speed) + (turn_speed * turn_dir)
-        r_wheel_speed = (drive_dir * forward_speed) - (turn_speed * turn_dir)
-
-        self.cozmo.drive_wheels(l_wheel_speed, r_wheel_speed, l_wheel_speed*4, r_wheel_speed*4)
+        return moved
 
 class BatteryStateDisplay(cozmo.annotate.Annotator):
 
@@ -266,34 +319,144 @@ class BatteryStateDisplay(cozmo.annotate.Annotator):
             TEXT_HEIGHT = 40
             bounds[1] += TEXT_HEIGHT
 
-        robot = self.world.robot
+        state = remote_control_cozmo.environment.state
+        if state is None:
+            return
 
-        battery_voltage = round(robot.battery_voltage,2)
+        battery_voltage = state.battery_voltage
         
-        if battery_voltage < 3.6 and not remote_control_cozmo.cozmo.is_on_charger:
+        if state.status == DANGER:
             print_line('WARNING, BATTERY LOW. RETURN TO CHARGER!', 'red')
-        elif remote_control_cozmo.cozmo.is_on_charger:
+        elif state.status == CHARGING:
             print_line('BATTERY CHARGING', 'white')
         elif battery_voltage > 3.6 and battery_voltage < 4:
             print_line('BATTERY OK', 'yellow')
         else:
             print_line('BATTERY GOOD', 'green')
 
+
+def default_camera_image():
+    image_bytes = bytearray([0x70, 0x70, 0x70]) * 320 * 240
+    return Image.frombytes('RGB', (320, 240), bytes(image_bytes))
+
+
+def encode_pil_image(pil_img):
+    img_io = BytesIO()
+    pil_img.save(img_io, 'JPEG')
+    return img_io.getvalue()
+
+
+def image_reply(frame):
+    return control_pb2.ImageReply(image=frame.image, frame_id=frame.sequence,
+                                  timestamp=int(frame.timestamp * 1000))
+
+
+def not_modified_reply(frame):
+    return control_pb2.ImageReply(frame_id=frame.sequence, timestamp=int(frame.timestamp * 1000),
+                                  not_modified=True)
+
+
+def say_text_error(response):
+    '''Details of why the chat or unlock response failed, or None'''
+    if not response.done() or response.exception() is None:
+        return None
+    details = 'Unable to respond to speech: %s' % response.exception()
+    logging.error(details)
+    return details
+
+
+def say_text_reply(ticket, response):
+    if not response.done():
+        return control_pb2.Reply(ticket=ticket, pending=True)
+    return control_pb2.Reply(message=response.result(), ticket=ticket)
+
+
+def prewarm_speech():
+    '''Renders the fixed lines, and the trained prompts and answers in the voices
+       chat_engine speaks them in, before anyone asks for them'''
+    lines = [(voice_engine.FEMALE, battery_warning),
+             (voice_engine.FEMALE, chat_engine.unlocked_response),
+             (voice_engine.FEMALE, chat_engine.incorrect_response)]
+    for i, text in enumerate(chat_trainer.corpus):
+        lines.append((voice_engine.MALE if i % 2 == 0 else voice_engine.FEMALE, text))
+    voice_engine.prewarm(lines)
+
+
+class SpeechTickets:
+    '''Responses to accepted handleSayTextEvent calls, by ticket. Tickets
+       start from the time the server started so they don't repeat across
+       restarts, and finished ones are dropped ttl seconds after acceptance.'''
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.next_ticket = int(time.time() * 1000)
+        # ticket: (future, accepted_at)
+        self.tickets = {}
+
+    def add(self, start, limit):
+        '''Calls start for the future of a new ticket, unless limit tickets are
+           already unfinished; returns the ticket, or None if there were too many'''
+        with self.lock:
+            self.expire()
+            if sum(1 for future, accepted_at in self.tickets.values() if not future.done()) >= limit:
+                return None
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.tickets[ticket] = (start(), time.time())
+        return ticket
+
+    def get(self, ticket):
+        with self.lock:
+            entry = self.tickets.get(ticket)
+        return entry[0] if entry else None
+
+    def expire(self):
+        now = time.time()
+        for ticket, (future, accepted_at) in list(self.tickets.items()):
+            if future.done() and now - accepted_at > self.ttl:
+                del self.tickets[ticket]
+
+
+def server_credentials():
+    keys = pkg_resources.resource_string(__name__, './certs/server.key')
+    certs = pkg_resources.resource_string(__name__, './certs/server.crt')
+    ca = pkg_resources.resource_string(__name__, './certs/ca.crt')
+    key_cert = (((keys, certs),))
+    return grpc.ssl_server_credentials(key_cert, ca, True)
+
             
 class Control(control_pb2.ControlServicer):
 
-    while True:
-        try:
-            ffmpeg_process = Popen(['ffmpeg', '-y', '-f', 'image2pipe', '-vcodec', 'mjpeg', '-r', '13', '-i', '-', '-s', '800x450', '-vcodec', 'libx264', '-b:v', '120k', '-r', '13', '-f', 'flv', 'rtmp://192.168.1.108:1935/live/perception'], stdin=PIPE)
-        except:
-            continue
-        break
+    # Each image stream holds a server worker for as long as the viewer is connected
+    max_image_streams = 8
+    # Upper bound on how long handleImageGetEvent will wait for a new frame
+    max_image_wait_ms = 1000
+    # Workers kept free for key, reset and image requests
+    rpc_workers = 8
+    # handleSayTextEvent only queues the speech and chat work and returns a ticket.
+    # Requests beyond max_pending_speech unfinished tickets are rejected, and at most
+    # that many handleSayTextResultEvent calls hold a worker while they wait.
+    max_pending_speech = 4
+    # Upper bound on how long handleSayTextResultEvent will wait for a response
+    max_say_text_wait_ms = 10000
+    # Each key stream holds a server worker for as long as the driver is connected
+    max_key_streams = 2
+
+    @classmethod
+    def server_workers(cls):
+        return cls.rpc_workers + cls.max_image_streams + cls.max_pending_speech + cls.max_key_streams
 
     def __init__(self):
-        image_bytes = bytearray([0x70, 0x70, 0x70]) * 320 * 240
-        default_camera_image = Image.frombytes('RGB', (320, 240), bytes(image_bytes))
-        self.camera_image = default_camera_image
+        self.frame_ring = FrameRing()
+        self.frame_ring.push(encode_pil_image(default_camera_image()))
         self.last_camera_update_time = int(time.time() * 1000)
+        self.frame_broadcaster = FrameBroadcaster(max_subscribers=self.max_image_streams)
+        self.stream_feeder = StreamFeeder(ffmpeg_command)
+        self.stream_feeder.start()
+        self.speech_tickets = SpeechTickets()
+        self.result_waits = threading.BoundedSemaphore(self.max_pending_speech)
+        self.key_streams = threading.BoundedSemaphore(self.max_key_streams)
         global scheduler
         scheduler.add_job(self.refreshImage, 'interval', seconds = 0.08333)
         scheduler.start()
@@ -302,34 +465,99 @@ class Control(control_pb2.ControlServicer):
         if remote_control_cozmo:
             image = remote_control_cozmo.cozmo.world.latest_image
             if image:
-                self.camera_image = self.serve_pil_image(image.annotate_image(scale=2))
+                self.serve_pil_image(image.annotate_image(scale=2))
         
-    def serve_pil_image(self, pil_img, jpeg_quality=50):
-        '''Convert PIL image to relevant image file and send it'''
-        img_io = BytesIO()
-        pil_img.save(img_io, 'JPEG')
-        pil_img.save(self.ffmpeg_process.stdin, 'JPEG')
-        img_io.seek(0)
-
-        return img_io.getvalue()
+    def serve_pil_image(self, pil_img):
+        '''Encode PIL image once and send the same bytes to RPC clients and the stream'''
+        frame = self.frame_ring.push(encode_pil_image(pil_img))
+        self.frame_broadcaster.publish(frame)
+        self.stream_feeder.feed(frame)
 
     def handleImageGetEvent(self, payload, more):
-        return control_pb2.ImageReply(image=(self.camera_image))
+        frame = self.frame_ring.latest()
+        if payload.last_frame_id == frame.sequence:
+            if payload.wait_ms > 0:
+                wait_ms = min(payload.wait_ms, self.max_image_wait_ms)
+                frame = self.frame_ring.wait_for_newer(frame.sequence, wait_ms / 1000.0)
+            if payload.last_frame_id == frame.sequence:
+                return not_modified_reply(frame)
+        return image_reply(frame)
+
+    def handleImageStreamEvent(self, payload, context):
+        subscriber = self.frame_broadcaster.subscribe()
+        if subscriber is None:
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details('Too many image streams')
+            return
+        context.add_callback(subscriber.close)
+        try:
+            while context.is_active():
+                frame = subscriber.take(timeout=1)
+                if frame is not None:
+                    yield image_reply(frame)
+        finally:
+            self.frame_broadcaster.unsubscribe(subscriber)
 
 
-    def handleKeyEvent(self, payload, keyDown):
+    def apply_key_event(self, payload):
         if remote_control_cozmo:
             remote_control_cozmo.handle_key(key_code=(payload.key_code), is_shift_down=payload.is_shift_down,
                                             is_ctrl_down=payload.is_ctrl_down, is_alt_down=payload.is_alt_down,
                                             is_key_down=payload.is_key_down)
-        return control_pb2.Reply(message="Success")
 
+    def handleKeyEvent(self, payload, keyDown):
+        self.apply_key_event(payload)
+        return control_pb2.Reply(message="Success")
 
-    def handleSayTextEvent(self, payload, more):
+    def handleKeyStreamEvent(self, request_iterator, context):
+        if not self.key_streams.acquire(blocking=False):
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details('Too many key streams')
+            return
+        try:
+            sequence = 0
+            for payload in request_iterator:
+                # Clients that do not number their events get acks numbered in arrival order
+                sequence = payload.sequence or sequence + 1
+                self.apply_key_event(payload)
+                yield control_pb2.KeyAck(sequence=sequence, applied_at=int(time.time() * 1000))
+        finally:
+            self.key_streams.release()
+
+
+    def say_text(self, text):
+        '''Queues text on the robot and returns a future for the chat or unlock response'''
+        remote_control_cozmo.say_text(text)
+        return chat_engine.submit_speech_input(text)
+
+    def handleSayTextEvent(self, payload, context):
         if remote_control_cozmo:
-            remote_control_cozmo.try_say_text(payload.text)
-            response = chat_engine.process_speech_input(payload.text)
-            return control_pb2.Reply(message=response)
+            ticket = self.speech_tickets.add(lambda: self.say_text(payload.text), self.max_pending_speech)
+            if ticket is None:
+                context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+                context.set_details('Too many speech requests in flight')
+                return control_pb2.Reply()
+            return control_pb2.Reply(ticket=ticket, pending=True)
+        return control_pb2.Reply()
+
+    def handleSayTextResultEvent(self, payload, context):
+        response = self.speech_tickets.get(payload.ticket)
+        if response is None:
+            context.set_code(grpc.StatusCode.NOT_FOUND)
+            context.set_details('Unknown or expired ticket')
+            return control_pb2.Reply()
+        if not response.done() and payload.wait_ms > 0 and self.result_waits.acquire(blocking=False):
+            try:
+                futures.wait([response], min(payload.wait_ms, self.max_say_text_wait_ms) / 1000.0)
+            finally:
+                self.result_waits.release()
+        error = say_text_error(response)
+        if error is not None:
+            # e.g. the game backend timed out; don't pass it off as an empty chatbot answer
+            context.set_code(grpc.StatusCode.UNAVAILABLE)
+            context.set_details(error)
+            return control_pb2.Reply(ticket=payload.ticket)
+        return say_text_reply(payload.ticket, response)
 
     def handleResetEvent(self, payload, more):
         if remote_control_cozmo:
@@ -342,30 +570,30 @@ def run(sdk_conn):
     robot.world.image_annotator.add_annotator('battery', BatteryStateDisplay);
     global remote_control_cozmo
     global scheduler
-    global timer
     remote_control_cozmo = RemoteControlCozmo(robot)
+    remote_control_cozmo.environment.start()
+    prewarm_speech()
 
     # Turn on image receiving by the camera
     robot.camera.image_stream_enabled = True
 
-    keys = pkg_resources.resource_string(__name__, './certs/server.key')
-    certs = pkg_resources.resource_string(__name__, './certs/server.crt')
-    ca = pkg_resources.resource_string(__name__, './certs/ca.crt')
-    key_cert = (((keys, certs),))
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
-    creds = grpc.ssl_server_credentials(key_cert, ca, True)
-    control_pb2.add_ControlServicer_to_server(Control(), server)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=Control.server_workers()))
+    creds = server_credentials()
+    control = Control()
+    control_pb2.add_ControlServicer_to_server(control, server)
     server.add_secure_port('rpc:50051', creds)
     server.start()
 
-    while True:
-        remote_control_cozmo.update_environment()
-        if not robot.conn.is_connected:
-            scheduler.shutdown(wait=False)
-            timer.cancel()
-            timer.join()
-            sys.exit()
-        time.sleep(1)
+    remote_control_cozmo.environment.disconnected.wait()
+    scheduler.shutdown(wait=False)
+    control.stream_feeder.stop()
+    chat_engine.stop()
+    remote_control_cozmo.motor_controller.stop()
+    remote_control_cozmo.environment.stop()
+    voice_engine.stop()
+    if remote_control_cozmo.effects_engine:
+        remote_control_cozmo.effects_engine.stop()
+    sys.exit()
 
 if __name__ == '__main__':
     cozmo.setup_basic_logging()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+'''Asyncio variant of control.py, built on grpc.aio (needs grpcio 1.32 or later).
+
+   The Control handlers, frame refresh, environment polling and battery warnings
+   all run as coroutines on one event loop. Blocking SDK calls, JPEG encoding and
+   speech are handed to small executors.'''
+
+import asyncio
+import concurrent.futures as futures
+import functools
+import logging
+import sys
+import time
+import cozmo
+import grpc
+from grpc import aio
+import chat_engine
+import control
+import control_pb2
+from camera_engine import FrameRing, StreamFeeder
+from control import BatteryStateDisplay, Control, RemoteControlCozmo
+
+refresh_interval = 0.08333
+
+
+def annotate_and_encode(image):
+    return control.encode_pil_image(image.annotate_image(scale=2))
+
+
+class AsyncControl(control_pb2.ControlServicer):
+
+    def __init__(self, robot):
+        self.robot = robot
+        self.loop = asyncio.get_event_loop()
+        self.frame_ring = FrameRing()
+        self.frame_ring.push(control.encode_pil_image(control.default_camera_image()))
+        self.frame_condition = asyncio.Condition()
+        self.image_streams = 0
+        self.stream_feeder = StreamFeeder(control.ffmpeg_command)
+        self.stream_feeder.start()
+        self.blocking_executor = futures.ThreadPoolExecutor(max_workers=2)
+        self.speech_tickets = control.SpeechTickets()
+        self.key_streams = 0
+
+    def run_blocking(self, executor, func, *args, **kwargs):
+        return self.loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self.stream_feeder.stop()
+        self.blocking_executor.shutdown(wait=False)
+        chat_engine.stop()
+
+    async def next_frame(self, sequence):
+        async with self.frame_condition:
+            await self.frame_condition.wait_for(lambda: self.frame_ring.sequence != sequence)
+        return self.frame_ring.latest()
+
+    async def refresh_images(self):
+        while True:
+            started = self.loop.time()
+            image = self.robot.world.latest_image
+            if image:
+                encoded = await self.run_blocking(self.blocking_executor, annotate_and_encode, image)
+                frame = self.frame_ring.push(encoded)
+                async with self.frame_condition:
+                    self.frame_condition.notify_all()
+                self.stream_feeder.feed(frame)
+            await asyncio.sleep(max(0, refresh_interval - (self.loop.time() - started)))
+
+    async def poll_environment(self):
+        '''Returns once the robot disconnects'''
+        monitor = control.remote_control_cozmo.environment
+        while not monitor.disconnected.is_set():
+            try:
+                monitor.sample()
+            except Exception as e:
+                logging.error('Environment sample failed: %s' % e)
+            await asyncio.sleep(monitor.interval)
+
+    async def handleImageGetEvent(self, payload, context):
+        frame = self.frame_ring.latest()
+        if payload.last_frame_id == frame.sequence:
+            if payload.wait_ms > 0:
+                wait_ms = min(payload.wait_ms, Control.max_image_wait_ms)
+                try:
+                    frame = await asyncio.wait_for(self.next_frame(frame.sequence), wait_ms / 1000.0)
+                except asyncio.TimeoutError:
+                    pass
+            if payload.last_frame_id == frame.sequence:
+                return control.not_modified_reply(frame)
+        return control.image_reply(frame)
+
+    async def handleImageStreamEvent(self, payload, context):
+        if self.image_streams >= Control.max_image_streams:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Too many image streams')
+        self.image_streams += 1
+        try:
+            frame = self.frame_ring.latest()
+            while True:
+                # Frames published while the previous write was in flight are skipped
+                yield control.image_reply(frame)
+                frame = await self.next_frame(frame.sequence)
+        finally:
+            self.image_streams -= 1
+
+    def apply_key_event(self, payload):
+        # Only updates the motor intent, so it is cheap enough to run on the loop
+        if control.remote_control_cozmo:
+            control.remote_control_cozmo.handle_key(key_code=(payload.key_code), is_shift_down=payload.is_shift_down,
+                                                    is_ctrl_down=payload.is_ctrl_down, is_alt_down=payload.is_alt_down,
+                                                    is_key_down=payload.is_key_down)
+
+    async def handleKeyEvent(self, payload, context):
+        self.apply_key_event(payload)
+        return control_pb2.Reply(message="Success")
+
+    async def handleKeyStreamEvent(self, request_iterator, context):
+        if self.key_streams >= Control.max_key_streams:
+            await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Too many key streams')
+        self.key_streams += 1
+        try:
+            sequence = 0
+            async for payload in request_iterator:
+                sequence = payload.sequence or sequence + 1
+                self.apply_key_event(payload)
+                yield control_pb2.KeyAck(sequence=sequence, applied_at=int(time.time() * 1000))
+        finally:
+            self.key_streams -= 1
+
+    def say_text(self, text):
+        # Only queues work for the speech and chat workers, so it can run on the loop
+        control.remote_control_cozmo.say_text(text)
+        return chat_engine.submit_speech_input(text)
+
+    async def handleSayTextEvent(self, payload, context):
+        if control.remote_control_cozmo:
+            ticket = self.speech_tickets.add(lambda: self.say_text(payload.text), Control.max_pending_speech)
+            if ticket is None:
+                await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Too many speech requests in flight')
+            return control_pb2.Reply(ticket=ticket, pending=True)
+        return control_pb2.Reply()
+
+    async def handleSayTextResultEvent(self, payload, context):
+        response = self.speech_tickets.get(payload.ticket)
+        if response is None:
+            await context.abort(grpc.StatusCode.NOT_FOUND, 'Unknown or expired ticket')
+        if not response.done() and payload.wait_ms > 0:
+            # asyncio.wait leaves the response running if the wait times out
+            await asyncio.wait([asyncio.wrap_future(response)],
+                               timeout=min(payload.wait_ms, Control.max_say_text_wait_ms) / 1000.0)
+        error = control.say_text_error(response)
+        if error is not None:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, error)
+        return control.say_text_reply(payload.ticket, response)
+
+    async def handleResetEvent(self, payload, context):
+        if control.remote_control_cozmo:
+            control.remote_control_cozmo.reset()
+        return control_pb2.Reply(message="Success")
+
+
+async def serve(robot):
+    server = aio.server()
+    servicer = AsyncControl(robot)
+    control_pb2.add_ControlServicer_to_server(servicer, server)
+    server.add_secure_port('rpc:50051', control.server_credentials())
+    await server.start()
+
+    refresh = asyncio.ensure_future(servicer.refresh_images())
+    try:
+        await servicer.poll_environment()
+    finally:
+        refresh.cancel()
+        await server.stop(0)
+        servicer.shutdown()
+        control.remote_control_cozmo.motor_controller.stop()
+        control.voice_engine.stop()
+        if control.remote_control_cozmo.effects_engine:
+            control.remote_control_cozmo.effects_engine.stop()
+
+
+def run(sdk_conn):
+    robot = sdk_conn.wait_for_robot()
+    robot.world.image_annotator.add_annotator('battery', BatteryStateDisplay);
+    control.remote_control_cozmo = RemoteControlCozmo(robot)
+    control.prewarm_speech()
+
+    # Turn on image receiving by the camera
+    robot.camera.image_stream_enabled = True
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(serve(robot))
+    finally:
+        loop.close()
+    sys.exit()
+
+if __name__ == '__main__':
+    cozmo.setup_basic_logging()
+
+    while True:
+        try:
+            cozmo.connect(run, connector=cozmo.run.FirstAvailableConnector())
+            break
+        except cozmo.ConnectionError as e:
+            logging.error("A connection error occurred: %s. Retrying in 10 seconds" % e)
+            time.sleep(10)
@@ -19,7 +19,7 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   name='control.proto',
   package='control',
   syntax='proto3',
-  serialized_pb=_b('\n\rcontrol.proto\x12\x07\x63ontrol\"\x0c\n\nEmptyEvent\"\x19\n\tTextEvent\x12\x0c\n\x04text\x18\x01 \x01(\t\"s\n\x08KeyEvent\x12\x10\n\x08key_code\x18\x01 \x01(\x05\x12\x15\n\ris_shift_down\x18\x02 \x01(\x05\x12\x14\n\x0cis_ctrl_down\x18\x03 \x01(\x05\x12\x13\n\x0bis_alt_down\x18\x04 \x01(\x05\x12\x13\n\x0bis_key_down\x18\x05 \x01(\x08\"\x1b\n\nImageReply\x12\r\n\x05image\x18\x01 \x01(\x0c\"\x18\n\x05Reply\x12\x0f\n\x07message\x18\x01 \x01(\t2\xfa\x01\n\x07\x43ontrol\x12\x35\n\x0ehandleKeyEvent\x12\x11.control.KeyEvent\x1a\x0e.control.Reply\"\x00\x12\x41\n\x13handleImageGetEvent\x12\x13.control.EmptyEvent\x1a\x13.control.ImageReply\"\x00\x12:\n\x12handleSayTextEvent\x12\x12.control.TextEvent\x1a\x0e.control.Reply\"\x00\x12\x39\n\x10handleResetEvent\x12\x13.control.EmptyEvent\x1a\x0e.control.Reply\"\x00\x62\x06proto3')
+  serialized_pb=_b('\n\rcontrol.proto\x12\x07\x63ontrol\"\x0c\n\nEmptyEvent\"\x19\n\tTextEvent\x12\x0c\n\x04text\x18\x01 \x01(\t\"\x85\x01\n\x08KeyEvent\x12\x10\n\x08key_code\x18\x01 \x01(\x05\x12\x15\n\ris_shift_down\x18\x02 \x01(\x05\x12\x14\n\x0cis_ctrl_down\x18\x03 \x01(\x05\x12\x13\n\x0bis_alt_down\x18\x04 \x01(\x05\x12\x13\n\x0bis_key_down\x18\x05 \x01(\x08\x12\x10\n\x08sequence\x18\x06 \x01(\x03\".\n\x06KeyAck\x12\x10\n\x08sequence\x18\x01 \x01(\x03\x12\x12\n\napplied_at\x18\x02 \x01(\x03\"6\n\x0cImageRequest\x12\x15\n\rlast_frame_id\x18\x01 \x01(\x03\x12\x0f\n\x07wait_ms\x18\x02 \x01(\x05\"V\n\nImageReply\x12\r\n\x05image\x18\x01 \x01(\x0c\x12\x10\n\x08\x66rame_id\x18\x02 \x01(\x03\x12\x11\n\ttimestamp\x18\x03 \x01(\x03\x12\x14\n\x0cnot_modified\x18\x04 \x01(\x08\"0\n\rTicketRequest\x12\x0e\n\x06ticket\x18\x01 \x01(\x03\x12\x0f\n\x07wait_ms\x18\x02 \x01(\x05\"9\n\x05Reply\x12\x0f\n\x07message\x18\x01 \x01(\t\x12\x0e\n\x06ticket\x18\x02 \x01(\x03\x12\x0f\n\x07pending\x18\x03 \x01(\x08\x32\xcc\x03\n\x07\x43ontrol\x12\x35\n\x0ehandleKeyEvent\x12\x11.control.KeyEvent\x1a\x0e.control.Reply\"\x00\x12\x43\n\x13handleImageGetEvent\x12\x15.control.ImageRequest\x1a\x13.control.ImageReply\"\x00\x12:\n\x12handleSayTextEvent\x12\x12.control.TextEvent\x1a\x0e.control.Reply\"\x00\x12\x44\n\x18handleSayTextResultEvent\x12\x16.control.TicketRequest\x1a\x0e.control.Reply\"\x00\x12\x39\n\x10handleResetEvent\x12\x13.control.EmptyEvent\x1a\x0e.control.Reply\"\x00\x12\x46\n\x16handleImageStreamEvent\x12\x13.control.EmptyEvent\x1a\x13.control.ImageReply\"\x00\x30\x01\x12@\n\x14handleKeyStreamEvent\x12\x11.control.KeyEvent\x1a\x0f.control.KeyAck\"\x00(\x01\x30\x01\x62\x06proto3')
 )
 _sym_db.RegisterFileDescriptor(DESCRIPTOR)
 
@@ -123,6 +123,13 @@ _KEYEVENT = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='sequence', full_name='control.KeyEvent.sequence', index=5,
+      number=6, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -135,8 +142,84 @@ _KEYEVENT = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=67,
-  serialized_end=182,
+  serialized_start=68,
+  serialized_end=201,
+)
+
+
+_KEYACK = _descriptor.Descriptor(
+  name='KeyAck',
+  full_name='control.KeyAck',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='sequence', full_name='control.KeyAck.sequence', index=0,
+      number=1, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='applied_at', full_name='control.KeyAck.applied_at', index=1,
+      number=2, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=203,
+  serialized_end=249,
+)
+
+
+_IMAGEREQUEST = _descriptor.Descriptor(
+  name='ImageRequest',
+  full_name='control.ImageRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='last_frame_id', full_name='control.ImageRequest.last_frame_id', index=0,
+      number=1, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='wait_ms', full_name='control.ImageRequest.wait_ms', index=1,
+      number=2, type=5, cpp_type=1, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=251,
+  serialized_end=305,
 )
 
 
@@ -154,6 +237,27 @@ _IMAGEREPLY = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='frame_id', full_name='control.ImageReply.frame_id', index=1,
+      number=2, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='timestamp', full_name='control.ImageReply.timestamp', index=2,
+      number=3, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='not_modified', full_name='control.ImageReply.not_modified', index=3,
+      number=4, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -166,8 +270,46 @@ _IMAGEREPLY = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=184,
-  serialized_end=211,
+  serialized_start=307,
+  serialized_end=393,
+)
+
+
+_TICKETREQUEST = _descriptor.Descriptor(
+  name='TicketRequest',
+  full_name='control.TicketRequest',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='ticket', full_name='control.TicketRequest.ticket', index=0,
+      number=1, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='wait_ms', full_name='control.TicketRequest.wait_ms', index=1,
+      number=2, type=5, cpp_type=1, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  syntax='proto3',
+  extension_ranges=[],
+  oneofs=[
+  ],
+  serialized_start=395,
+  serialized_end=443,
 )
 
 
@@ -185,6 +327,20 @@ _REPLY = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='ticket', full_name='control.Reply.ticket', index=1,
+      number=2, type=3, cpp_type=2, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='pending', full_name='control.Reply.pending', index=2,
+      number=3, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -197,14 +353,17 @@ _REPLY = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=213,
-  serialized_end=237,
+  serialized_start=445,
+  serialized_end=502,
 )
 
 DESCRIPTOR.message_types_by_name['EmptyEvent'] = _EMPTYEVENT
 DESCRIPTOR.message_types_by_name['TextEvent'] = _TEXTEVENT
 DESCRIPTOR.message_types_by_name['KeyEvent'] = _KEYEVENT
+DESCRIPTOR.message_types_by_name['KeyAck'] = _KEYACK
+DESCRIPTOR.message_types_by_name['ImageRequest'] = _IMAGEREQUEST
 DESCRIPTOR.message_types_by_name['ImageReply'] = _IMAGEREPLY
+DESCRIPTOR.message_types_by_name['TicketRequest'] = _TICKETREQUEST
 DESCRIPTOR.message_types_by_name['Reply'] = _REPLY
 
 EmptyEvent = _reflection.GeneratedProtocolMessageType('EmptyEvent', (_message.Message,), dict(
@@ -228,6 +387,20 @@ KeyEvent = _reflection.GeneratedProtocolMessageType('KeyEvent', (_message.Messag
   ))
 _sym_db.RegisterMessage(KeyEvent)
 
+KeyAck = _reflection.GeneratedProtocolMessageType('KeyAck', (_message.Message,), dict(
+  DESCRIPTOR = _KEYACK,
+  __module__ = 'control_pb2'
+  # @@protoc_insertion_point(class_scope:control.KeyAck)
+  ))
+_sym_db.RegisterMessage(KeyAck)
+
+ImageRequest = _reflection.GeneratedProtocolMessageType('ImageRequest', (_message.Message,), dict(
+  DESCRIPTOR = _IMAGEREQUEST,
+  __module__ = 'control_pb2'
+  # @@protoc_insertion_point(class_scope:control.ImageRequest)
+  ))
+_sym_db.RegisterMessage(ImageRequest)
+
 ImageReply = _reflection.GeneratedProtocolMessageType('ImageReply', (_message.Message,), dict(
   DESCRIPTOR = _IMAGEREPLY,
   __module__ = 'control_pb2'
@@ -235,6 +408,13 @@ ImageReply = _reflection.GeneratedProtocolMessageType('ImageReply', (_message.Me
   ))
 _sym_db.RegisterMessage(ImageReply)
 
+TicketRequest = _reflection.GeneratedProtocolMessageType('TicketRequest', (_message.Message,), dict(
+  DESCRIPTOR = _TICKETREQUEST,
+  __module__ = 'control_pb2'
+  # @@protoc_insertion_point(class_scope:control.TicketRequest)
+  ))
+_sym_db.RegisterMessage(TicketRequest)
+
 Reply = _reflection.GeneratedProtocolMessageType('Reply', (_message.Message,), dict(
   DESCRIPTOR = _REPLY,
   __module__ = 'control_pb2'
@@ -265,7 +445,7 @@ class ControlStub(object):
         )
     self.handleImageGetEvent = channel.unary_unary(
         '/control.Control/handleImageGetEvent',
-        request_serializer=EmptyEvent.SerializeToString,
+        request_serializer=ImageRequest.SerializeToString,
         response_deserializer=ImageReply.FromString,
         )
     self.handleSayTextEvent = channel.unary_unary(
@@ -273,11 +453,26 @@ class ControlStub(object):
         request_serializer=TextEvent.SerializeToString,
         response_deserializer=Reply.FromString,
         )
+    self.handleSayTextResultEvent = channel.unary_unary(
+        '/control.Control/handleSayTextResultEvent',
+        request_serializer=TicketRequest.SerializeToString,
+        response_deserializer=Reply.FromString,
+        )
     self.handleResetEvent = channel.unary_unary(
         '/control.Control/handleResetEvent',
         request_serializer=EmptyEvent.SerializeToString,
         response_deserializer=Reply.FromString,
         )
+    self.handleImageStreamEvent = channel.unary_stream(
+        '/control.Control/handleImageStreamEvent',
+        request_serializer=EmptyEvent.SerializeToString,
+        response_deserializer=ImageReply.FromString,
+        )
+    self.handleKeyStreamEvent = channel.stream_stream(
+        '/control.Control/handleKeyStreamEvent',
+        request_serializer=KeyEvent.SerializeToString,
+        response_deserializer=KeyAck.FromString,
+        )
 
 
 class ControlServicer(object):
@@ -290,11 +485,26 @@ class ControlServicer(object):
     raise NotImplementedError('Method not implemented!')
 
   def handleImageGetEvent(self, request, context):
+    """Returns not_modified instead of the image if last_frame_id is still the latest frame.
+    A non-zero wait_ms waits up to that long for a newer frame first.
+    """
     context.set_code(grpc.StatusCode.UNIMPLEMENTED)
     context.set_details('Method not implemented!')
     raise NotImplementedError('Method not implemented!')
 
   def handleSayTextEvent(self, request, context):
+    """Returns straight away with a ticket and pending set; the chat or unlock response
+    that follows is collected with handleSayTextResultEvent.
+    """
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def handleSayTextResultEvent(self, request, context):
+    """Waits up to wait_ms for the response to a handleSayTextEvent ticket.
+    pending is still set if it is not ready yet. Fails with UNAVAILABLE if the
+    chatbot lookup or unlock attempt failed.
+    """
     context.set_code(grpc.StatusCode.UNIMPLEMENTED)
     context.set_details('Method not implemented!')
     raise NotImplementedError('Method not implemented!')
@@ -304,6 +514,20 @@ class ControlServicer(object):
     context.set_details('Method not implemented!')
     raise NotImplementedError('Method not implemented!')
 
+  def handleImageStreamEvent(self, request, context):
+    """Pushes each new camera frame once, dropping frames the client is too slow to take
+    """
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def handleKeyStreamEvent(self, request_iterator, context):
+    """Applies key events in the order sent over one long-lived stream, acking each one
+    """
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
 
 def add_ControlServicer_to_server(servicer, server):
   rpc_method_handlers = {
@@ -314,7 +538,7 @@ def add_ControlServicer_to_server(servicer, server):
       ),
       'handleImageGetEvent': grpc.unary_unary_rpc_method_handler(
           servicer.handleImageGetEvent,
-          request_deserializer=EmptyEvent.FromString,
+          request_deserializer=ImageRequest.FromString,
           response_serializer=ImageReply.SerializeToString,
       ),
       'handleSayTextEvent': grpc.unary_unary_rpc_method_handler(
@@ -322,11 +546,26 @@ def add_ControlServicer_to_server(servicer, server):
           request_deserializer=TextEvent.FromString,
           response_serializer=Reply.SerializeToString,
       ),
+      'handleSayTextResultEvent': grpc.unary_unary_rpc_method_handler(
+          servicer.handleSayTextResultEvent,
+          request_deserializer=TicketRequest.FromString,
+          response_serializer=Reply.SerializeToString,
+      ),
       'handleResetEvent': grpc.unary_unary_rpc_method_handler(
           servicer.handleResetEvent,
           request_deserializer=EmptyEvent.FromString,
           response_serializer=Reply.SerializeToString,
       ),
+      'handleImageStreamEvent': grpc.unary_stream_rpc_method_handler(
+          servicer.handleImageStreamEvent,
+          request_deserializer=EmptyEvent.FromString,
+          response_serializer=ImageReply.SerializeToString,
+      ),
+      'handleKeyStreamEvent': grpc.stream_stream_rpc_method_handler(
+          servicer.handleKeyStreamEvent,
+          request_deserializer=KeyEvent.FromString,
+          response_serializer=KeyAck.SerializeToString,
+      ),
   }
   generic_handler = grpc.method_handlers_generic_handler(
       'control.Control', rpc_method_handlers)
@@ -344,11 +583,31 @@ class BetaControlServicer(object):
     """
     context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
   def handleImageGetEvent(self, request, context):
+    """Returns not_modified instead of the image if last_frame_id is still the latest frame.
+    A non-zero wait_ms waits up to that long for a newer frame first.
+    """
     context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
   def handleSayTextEvent(self, request, context):
+    """Returns straight away with a ticket and pending set; the chat or unlock response
+    that follows is collected with handleSayTextResultEvent.
+    """
+    context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
+  def handleSayTextResultEvent(self, request, context):
+    """Waits up to wait_ms for the response to a handleSayTextEvent ticket.
+    pending is still set if it is not ready yet. Fails with UNAVAILABLE if the
+    chatbot lookup or unlock attempt failed.
+    """
     context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
   def handleResetEvent(self, request, context):
     context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
+  def handleImageStreamEvent(self, request, context):
+    """Pushes each new camera frame once, dropping frames the client is too slow to take
+    """
+    context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
+  def handleKeyStreamEvent(self, request_iterator, context):
+    """Applies key events in the order sent over one long-lived stream, acking each one
+    """
+    context.code(beta_interfaces.StatusCode.UNIMPLEMENTED)
 
 
 class BetaControlStub(object):
@@ -363,14 +622,35 @@ class BetaControlStub(object):
     raise NotImplementedError()
   handleKeyEvent.future = None
   def handleImageGetEvent(self, request, timeout, metadata=None, with_call=False, protocol_options=None):
+    """Returns not_modified instead of the image if last_frame_id is still the latest frame.
+    A non-zero wait_ms waits up to that long for a newer frame first.
+    """
     raise NotImplementedError()
   handleImageGetEvent.future = None
   def handleSayTextEvent(self, request, timeout, metadata=None, with_call=False, protocol_options=None):
+    """Returns straight away with a ticket and pending set; the chat or unlock response
+    that follows is collected with handleSayTextResultEvent.
+    """
     raise NotImplementedError()
   handleSayTextEvent.future = None
+  def handleSayTextResultEvent(self, request, timeout, metadata=None, with_call=False, protocol_options=None):
+    """Waits up to wait_ms for the response to a handleSayTextEvent ticket.
+    pending is still set if it is not ready yet. Fails with UNAVAILABLE if the
+    chatbot lookup or unlock attempt failed.
+    """
+    raise NotImplementedError()
+  handleSayTextResultEvent.future = None
   def handleResetEvent(self, request, timeout, metadata=None, with_call=False, protocol_options=None):
     raise NotImplementedError()
   handleResetEvent.future = None
+  def handleImageStreamEvent(self, request, timeout, metadata=None, with_call=False, protocol_options=None):
+    """Pushes each new camera frame once, dropping frames the client is too slow to take
+    """
+    raise NotImplementedError()
+  def handleKeyStreamEvent(self, request_iterator, timeout, metadata=None, with_call=False, protocol_options=None):
+    """Applies key events in the order sent over one long-lived stream, acking each one
+    """
+    raise NotImplementedError()
 
 
 def beta_create_Control_server(servicer, pool=None, pool_size=None, default_timeout=None, maximum_timeout=None):
@@ -380,22 +660,31 @@ def beta_create_Control_server(servicer, pool=None, pool_size=None, default_time
   file not marked beta) for all further purposes. This function was
   generated only to ease transition from grpcio<0.15.0 to grpcio>=0.15.0"""
   request_deserializers = {
-    ('control.Control', 'handleImageGetEvent'): EmptyEvent.FromString,
+    ('control.Control', 'handleImageGetEvent'): ImageRequest.FromString,
+    ('control.Control', 'handleImageStreamEvent'): EmptyEvent.FromString,
     ('control.Control', 'handleKeyEvent'): KeyEvent.FromString,
+    ('control.Control', 'handleKeyStreamEvent'): KeyEvent.FromString,
     ('control.Control', 'handleResetEvent'): EmptyEvent.FromString,
     ('control.Control', 'handleSayTextEvent'): TextEvent.FromString,
+    ('control.Control', 'handleSayTextResultEvent'): TicketRequest.FromString,
   }
   response_serializers = {
     ('control.Control', 'handleImageGetEvent'): ImageReply.SerializeToString,
+    ('control.Control', 'handleImageStreamEvent'): ImageReply.SerializeToString,
     ('control.Control', 'handleKeyEvent'): Reply.SerializeToString,
+    ('control.Control', 'handleKeyStreamEvent'): KeyAck.SerializeToString,
     ('control.Control', 'handleResetEvent'): Reply.SerializeToString,
     ('control.Control', 'handleSayTextEvent'): Reply.SerializeToString,
+    ('control.Control', 'handleSayTextResultEvent'): Reply.SerializeToString,
   }
   method_implementations = {
     ('control.Control', 'handleImageGetEvent'): face_utilities.unary_unary_inline(servicer.handleImageGetEvent),
+    ('control.Control', 'handleImageStreamEvent'): face_utilities.unary_stream_inline(servicer.handleImageStreamEvent),
     ('control.Control', 'handleKeyEvent'): face_utilities.unary_unary_inline(servicer.handleKeyEvent),
+    ('control.Control', 'handleKeyStreamEvent'): face_utilities.stream_stream_inline(servicer.handleKeyStreamEvent),
     ('control.Control', 'handleResetEvent'): face_utilities.unary_unary_inline(servicer.handleResetEvent),
     ('control.Control', 'handleSayTextEvent'): face_utilities.unary_unary_inline(servicer.handleSayTextEvent),
+    ('control.Control', 'handleSayTextResultEvent'): face_utilities.unary_unary_inline(servicer.handleSayTextResultEvent),
   }
   server_options = beta_implementations.server_options(request_deserializers=request_deserializers, response_serializers=response_serializers, thread_pool=pool, thread_pool_size=pool_size, default_timeout=default_timeout, maximum_timeout=maximum_timeout)
   return beta_implementations.server(method_implementations, options=server_options)
@@ -408,22 +697,31 @@ def beta_create_Control_stub(channel, host=None, metadata_transformer=None, pool
   file not marked beta) for all further purposes. This function was
   generated only to ease transition from grpcio<0.15.0 to grpcio>=0.15.0"""
   request_serializers = {
-    ('control.Control', 'handleImageGetEvent'): EmptyEvent.SerializeToString,
+    ('control.Control', 'handleImageGetEvent'): ImageRequest.SerializeToString,
+    ('control.Control', 'handleImageStreamEvent'): EmptyEvent.SerializeToString,
     ('control.Control', 'handleKeyEvent'): KeyEvent.SerializeToString,
+    ('control.Control', 'handleKeyStreamEvent'): KeyEvent.SerializeToString,
     ('control.Control', 'handleResetEvent'): EmptyEvent.SerializeToString,
     ('control.Control', 'handleSayTextEvent'): TextEvent.SerializeToString,
+    ('control.Control', 'handleSayTextResultEvent'): TicketRequest.SerializeToString,
   }
   response_deserializers = {
     ('control.Control', 'handleImageGetEvent'): ImageReply.FromString,
+    ('control.Control', 'handleImageStreamEvent'): ImageReply.FromString,
     ('control.Control', 'handleKeyEvent'): Reply.FromString,
+    ('control.Control', 'handleKeyStreamEvent'): KeyAck.FromString,
     ('control.Control', 'handleResetEvent'): Reply.FromString,
     ('control.Control', 'handleSayTextEvent'): Reply.FromString,
+    ('control.Control', 'handleSayTextResultEvent'): Reply.FromString,
   }
   cardinalities = {
     'handleImageGetEvent': cardinality.Cardinality.UNARY_UNARY,
+    'handleImageStreamEvent': cardinality.Cardinality.UNARY_STREAM,
     'handleKeyEvent': cardinality.Cardinality.UNARY_UNARY,
+    'handleKeyStreamEvent': cardinality.Cardinality.STREAM_STREAM,
     'handleResetEvent': cardinality.Cardinality.UNARY_UNARY,
     'handleSayTextEvent': cardinality.Cardinality.UNARY_UNARY,
+    'handleSayTextResultEvent': cardinality.Cardinality.UNARY_UNARY,
   }
   stub_options = beta_implementations.stub_options(host=host, metadata_transformer=metadata_transformer, request_serializers=request_serializers, response_deserializers=response_deserializers, thread_pool=pool, thread_pool_size=pool_size)
   return beta_implementations.dynamic_stub(channel, 'control.Control', cardinalities, options=stub_options)
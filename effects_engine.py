@@ -0,0 +1,184 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from flux_led import LedProtocol, WifiLedBulb
+
+
+def colour_packet(colour):
+    '''Volatile (0x41) colour message, checksummed and ready to write'''
+    r, g, b = [int(round(c)) for c in colour]
+    return bytes(LedProtocol.addChecksum(LedProtocol.rgbMessage(r, g, b, persist=False)))
+
+
+def blend(a, b, amount):
+    return tuple(a[i] + (b[i] - a[i]) * amount for i in range(3))
+
+
+def gradient_table(colours, steps=64):
+    '''Packets fading through colours and back to the first, steps per colour'''
+    table = []
+    for i, colour in enumerate(colours):
+        following = colours[(i + 1) % len(colours)]
+        for step in range(steps):
+            table.append(colour_packet(blend(colour, following, step / float(steps))))
+    return table
+
+
+def pulse_table(colour, steps=64, floor=0.1):
+    '''Packets for one smooth pulse of colour, dimmed to floor at the start and end'''
+    table = []
+    for step in range(steps):
+        level = floor + (1 - floor) * (0.5 - 0.5 * math.cos(2 * math.pi * step / steps))
+        table.append(colour_packet(blend((0, 0, 0), colour, level)))
+    return table
+
+
+def meter_table(empty_colour, full_colour, steps=32):
+    '''Packets for a level meter, from empty_colour at 0 to full_colour at 1'''
+    return [colour_packet(blend(empty_colour, full_colour, step / float(steps - 1))) for step in range(steps)]
+
+
+class LoopEffect:
+    '''Plays a table once every period seconds'''
+
+    def __init__(self, table, period):
+        self.table = table
+        self.period = period
+
+    def frame(self, t):
+        return self.table[int((t % self.period) / self.period * len(self.table)) % len(self.table)]
+
+
+class MeterEffect:
+    '''Shows the value returned by source, scaled from low..high onto a meter table'''
+
+    def __init__(self, table, source, low, high):
+        self.table = table
+        self.source = source
+        self.low = low
+        self.high = high
+
+    def frame(self, t):
+        value = self.source()
+        if value is None:
+            return None
+        level = min(max((value - self.low) / float(self.high - self.low), 0), 1)
+        return self.table[int(level * (len(self.table) - 1))]
+
+
+class EffectsEngine:
+    '''Streams colour frames from the current effect to the bulbs at a fixed
+       rate over persistent connections. Frames are volatile colour writes, so
+       the bulb's stored settings are left alone, and a frame is only written
+       to a bulb when it differs from the last one sent to that bulb.
+
+       Keeps the achieved frame rate and the jitter of the tick times, both
+       over the last few seconds.'''
+
+    retry_interval = 5
+    connect_timeout = 0.5
+
+    def __init__(self, bulb_addrs, rate=30):
+        self.bulb_addrs = list(bulb_addrs)
+        self.period = 1.0 / rate
+        self.bulbs = dict((addr, None) for addr in self.bulb_addrs)
+        self.retry_after = dict((addr, 0) for addr in self.bulb_addrs)
+        self.effect = None
+        # Last packet written to each bulb, so a bulb that missed frames catches up
+        self.sent = dict((addr, None) for addr in self.bulb_addrs)
+        self.running = False
+        self.thread = None
+
+        self.ticks = deque(maxlen=rate * 5)
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.overruns = 0
+
+    def set_effect(self, effect):
+        self.effect = effect
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def stats(self):
+        ticks = list(self.ticks)
+        fps = 0
+        jitter = 0
+        max_jitter = 0
+        if len(ticks) > 1:
+            fps = (len(ticks) - 1) / (ticks[-1] - ticks[0])
+            errors = [abs(ticks[i] - ticks[i - 1] - self.period) for i in range(1, len(ticks))]
+            jitter = sum(errors) / len(errors)
+            max_jitter = max(errors)
+        return {'fps': fps, 'jitter': jitter, 'max_jitter': max_jitter, 'frames_sent': self.frames_sent,
+                'frames_skipped': self.frames_skipped, 'overruns': self.overruns}
+
+    def run(self):
+        start = time.time()
+        next_tick = start
+        while self.running:
+            now = time.time()
+            self.ticks.append(now)
+            try:
+                self.step(now - start)
+            except Exception as e:
+                logging.error('Effects step failed: %s' % e)
+            next_tick += self.period
+            delay = next_tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                next_tick = time.time()
+
+    def step(self, t):
+        effect = self.effect
+        if effect is None:
+            return
+        packet = effect.frame(t)
+        if packet is None:
+            self.frames_skipped += 1
+            return
+        written = False
+        for addr in self.bulb_addrs:
+            if packet != self.sent[addr]:
+                written = self.write(addr, packet) or written
+        if written:
+            self.frames_sent += 1
+        else:
+            self.frames_skipped += 1
+
+    def write(self, addr, packet):
+        '''Returns True if packet was written to the bulb'''
+        if time.time() < self.retry_after[addr]:
+            return False
+        try:
+            if self.bulbs[addr] is None:
+                self.bulbs[addr] = WifiLedBulb(addr, timeout=self.connect_timeout)
+            self.bulbs[addr].applyScene(packet)
+            self.sent[addr] = packet
+            return True
+        except (OSError, IOError) as e:
+            # Don't let an unreachable bulb stall the other bulbs' frames
+            logging.error('Unable to stream to bulb at %s: %s' % (addr, e))
+            self.disconnect(addr)
+            self.retry_after[addr] = time.time() + self.retry_interval
+            self.sent[addr] = None
+            return False
+
+    def disconnect(self, addr):
+        bulb = self.bulbs[addr]
+        self.bulbs[addr] = None
+        if bulb is not None:
+            try:
+                bulb.socket.close()
+            except (OSError, IOError):
+                pass
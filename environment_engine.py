@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+DANGER = 'danger'
+CHARGING = 'charging'
+PLAYING = 'playing'
+
+# Snapshot of the robot's environment. status is one of DANGER, CHARGING or PLAYING
+EnvironmentState = namedtuple('EnvironmentState', ['battery_voltage', 'on_charger', 'status'])
+
+
+class EnvironmentMonitor:
+    '''Samples the robot's battery and charger state at a single rate and caches
+       the derived game state, so the annotator, lights, sound and voice
+       warnings all read the same value instead of recomputing it.
+
+       Listeners added with add_listener are called with (state, previous)
+       whenever the status changes. Warning listeners are called every
+       warning_interval seconds while in danger.
+
+       Danger starts below low_battery_voltage and only ends above
+       recover_battery_voltage, so a noisy voltage near the threshold does not
+       flip the status back and forth.'''
+
+    low_battery_voltage = 3.6
+    recover_battery_voltage = 3.65
+
+    def __init__(self, robot, interval=0.1, warning_interval=20):
+        self.robot = robot
+        self.interval = interval
+        self.warning_interval = warning_interval
+        self.state = None
+        self.listeners = []
+        self.warning_listeners = []
+        self.last_warning_time = 0
+        self.disconnected = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def add_warning_listener(self, listener):
+        self.warning_listeners.append(listener)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running and not self.disconnected.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error('Environment sample failed: %s' % e)
+            time.sleep(self.interval)
+
+    def derive_state(self):
+        battery_voltage = round(self.robot.battery_voltage, 2)
+        on_charger = self.robot.is_on_charger
+
+        in_danger = self.state is not None and self.state.status == DANGER
+        threshold = self.recover_battery_voltage if in_danger else self.low_battery_voltage
+        if battery_voltage < threshold and not on_charger:
+            status = DANGER
+        elif on_charger:
+            status = CHARGING
+        else:
+            status = PLAYING
+        return EnvironmentState(battery_voltage, on_charger, status)
+
+    def sample(self):
+        if not self.robot.conn.is_connected:
+            self.disconnected.set()
+            return
+
+        previous = self.state
+        state = self.derive_state()
+        self.state = state
+
+        if previous is None or state.status != previous.status:
+            for listener in self.listeners:
+                listener(state, previous)
+
+        now = time.time()
+        if now - self.last_warning_time >= self.warning_interval:
+            self.last_warning_time = now
+            if state.status == DANGER:
+                for listener in self.warning_listeners:
+                    listener(state)
+            else:
+                print('Battery: %s' % state.battery_voltage)
@@ -11,7 +11,13 @@ So far most of the functionality of the apps is available here via the CLI
 and/or programmatically.
 
 The classes in this project could very easily be used as an API, and incorporated into a GUI app written 
-in PyQt, Kivy, or some other framework.
+in PyQt, Kivy, or some other framework.  Works with Python 2 and 3, e.g.:
+
+	from flux_led import WifiLedBulb
+	bulb = WifiLedBulb("192.168.1.100")
+	bulb.setRgb(255, 0, 0)
+
+Library calls raise exceptions rather than printing; only main() talks to the console.
 
 ##### Available:
 * Discovering bulbs on LAN
@@ -36,12 +42,16 @@ package is installed.  (Easily done via pip, easy_install, or apt-get, etc.)
  See the following for valid color names: http://www.w3schools.com/html/html_colornames.asp
 
 """
+from __future__ import print_function
 import socket
 import time
 import sys
 import datetime
 from optparse import OptionParser,OptionGroup
 import ast
+import logging
+import threading
+from collections import namedtuple
 try:
 	import webcolors
 	webcolors_available = True
@@ -49,10 +59,11 @@ except:
 	webcolors_available = False
 
 class utils:
+	# color strings already seen by color_object_to_tuple, and what they parsed to
+	color_cache = dict()
+
 	@staticmethod
 	def color_object_to_tuple(color):	
-		global webcolors_available
-
 		# see if it's already a color tuple
 		if type(color) is tuple and len(color) == 3:
 			return color
@@ -62,6 +73,14 @@ class utils:
 			return None
 		color = color.strip()
 
+		if color not in utils.color_cache:
+			utils.color_cache[color] = utils.parse_color_string(color)
+		return utils.color_cache[color]
+
+	@staticmethod
+	def parse_color_string(color):
+		global webcolors_available
+
 		if webcolors_available:
 			# try to convert from an english name
 			try:
@@ -102,14 +121,10 @@ class utils:
 	@staticmethod
 	def get_color_names_list():
 		names = set()
-		for key in webcolors.css2_hex_to_names.keys():
-			names.add(webcolors.css2_hex_to_names[key])
-		for key in webcolors.css21_hex_to_names.keys():
-			names.add(webcolors.css21_hex_to_names[key])
-		for key in webcolors.css3_hex_to_names.keys():
-			names.add(webcolors.css3_hex_to_names[key])
-		for key in webcolors.html4_hex_to_names.keys():
-			names.add(webcolors.html4_hex_to_names[key])			
+		# newer webcolors releases spell these in upper case
+		for table in ('css2_hex_to_names', 'css21_hex_to_names', 'css3_hex_to_names', 'html4_hex_to_names'):
+			hex_to_names = getattr(webcolors, table, None) or getattr(webcolors, table.upper(), {})
+			names.update(hex_to_names.values())
 		return sorted(names)
 		
 	@staticmethod
@@ -119,7 +134,7 @@ class utils:
 
 	@staticmethod
 	def dump_bytes(bytes):
-		print ''.join('{:02x} '.format(x) for x in bytearray(bytes))
+		print(''.join('{:02x} '.format(x) for x in bytearray(bytes)))
 	
 	max_delay = 0x1f
 	
@@ -195,7 +210,7 @@ class PresetPattern:
 	
 	@staticmethod
 	def valtostr(pattern):
-		for key, value in PresetPattern.__dict__.iteritems():
+		for key, value in PresetPattern.__dict__.items():
 			if type(value) is int and value == pattern:
 				return key.replace("_", " ").title()
 		return None
@@ -216,7 +231,7 @@ class LedTimer():
 
 	@staticmethod
 	def dayMaskToStr(mask):
-		for key, value in LedTimer.__dict__.iteritems():
+		for key, value in LedTimer.__dict__.items():
 			if type(value) is int and value == mask:
 				return key
 		return None  
@@ -440,19 +455,25 @@ class LedTimer():
 			
 		return txt
 
-class WifiLedBulb():
-	def __init__(self, ipaddr, port=5577):
-		self.ipaddr = ipaddr
-		self.port = port
-		self.__is_on = False
-		
-		self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.socket.connect((self.ipaddr, self.port))
-		
-		self.__state_str = ""
-		#self.refreshState()
+class LedProtocol:
+	"""Builds the bulb's command messages and parses its responses, independent
+	of how they are sent.  Shared by WifiLedBulb and the asyncio client in
+	flux_led_aio."""
+
+	# Response lengths, in bytes
+	state_length = 14
+	clock_length = 12
+	timers_length = 88
+	send_timers_length = 4
 
-	def __determineMode(self, ww_level, pattern_code):
+	@staticmethod
+	def addChecksum(msg):
+		# calculate checksum of byte array and add to end
+		msg.append(sum(msg) & 0xFF)
+		return msg
+
+	@staticmethod
+	def determineMode(ww_level, pattern_code):
 		mode = "unknown"
 		if pattern_code in [ 0x61, 0x62]:
 			if ww_level != 0:
@@ -465,55 +486,16 @@ class WifiLedBulb():
 			mode = "preset"
 		return mode
 
-	def refreshState(self):
-		msg = bytearray([0x81, 0x8a, 0x8b])
-		self.__write(msg)
-		rx = self.__readResponse(14)
-
-		power_state = rx[2]
-		power_str = "Unknown power state"
-
-		if power_state == 0x23:
-			self.__is_on = True
-			power_str = "ON "
-		elif power_state == 0x24:
-			self.__is_on = False
-			power_str = "OFF"
-			
-		pattern = rx[3]
-		ww_level = rx[9]
-		mode = self.__determineMode(ww_level, pattern)
-		delay = rx[5]
-		speed = utils.delayToSpeed(delay)
-		
-		if mode == "color":
-			red = rx[6]
-			green = rx[7]
-			blue = rx[8]
-			color_str = utils.color_tuple_to_string((red, green, blue))
-			mode_str = "Color: {}".format(color_str)
-		elif mode == "ww":
-			mode_str = "Warm White: {}%".format(utils.byteToPercent(ww_level))
-		elif mode == "preset":
-			pat = PresetPattern.valtostr(pattern)
-			mode_str = "Pattern: {} (Speed {}%)".format(pat, speed)
-		elif mode == "custom":
-			mode_str = "Custom pattern (Speed {}%)".format(speed)
-		else:
-			mode_str = "Unknown mode 0x{:x}".format(pattern)
-		if pattern == 0x62:
-			mode_str += " (tmp)"
-		self.__state_str = "{} [{}]".format(power_str, mode_str)
+	@staticmethod
+	def stateRequest():
+		return bytearray([0x81, 0x8a, 0x8b])
 
-	def __str__(self):
-		return self.__state_str
+	@staticmethod
+	def clockRequest():
+		return bytearray([0x11, 0x1a, 0x1b, 0x0f])
 
-			
-	def getClock(self):
-		msg = bytearray([0x11, 0x1a, 0x1b, 0x0f])
-		self.__write(msg)
-		rx = self.__readResponse(12)
-		#self.dump_data(rx)
+	@staticmethod
+	def parseClock(rx):
 		year =  rx[3] + 2000
 		month = rx[4]
 		date = rx[5]
@@ -527,9 +509,11 @@ class WifiLedBulb():
 			dt = None
 		return dt
 
-	def setClock(self):
+	@staticmethod
+	def setClockMessage(now=None):
+		if now is None:
+			now = datetime.datetime.now()
 		msg = bytearray([0x10, 0x14])
-		now = datetime.datetime.now()
 		msg.append(now.year-2000)
 		msg.append(now.month)
 		msg.append(now.day)
@@ -539,27 +523,17 @@ class WifiLedBulb():
 		msg.append(now.isoweekday()) # day of week
 		msg.append(0x00)
 		msg.append(0x0f)
-		self.__write(msg)
+		return msg
 
-	def turnOn(self, on=True):
+	@staticmethod
+	def powerMessage(on=True):
 		if on:
-			msg = bytearray([0x71, 0x23, 0x0f])
+			return bytearray([0x71, 0x23, 0x0f])
 		else:
-			msg = bytearray([0x71, 0x24, 0x0f])
-			
-		self.__write(msg)
-		#print "set bulb {}".format(on)
-		#time.sleep(.5)
-		#x = self.__readResponse(4)
-		self.__is_on = on
-		
-	def isOn(self):
-		return self.__is_on
-	
-	def turnOff(self):
-		self.turnOn(False)
-	
-	def setWarmWhite(self, level, persist=True):
+			return bytearray([0x71, 0x24, 0x0f])
+
+	@staticmethod
+	def warmWhiteMessage(level, persist=True):
 		if persist:
 			msg = bytearray([0x31])
 		else:
@@ -570,45 +544,35 @@ class WifiLedBulb():
 		msg.append(utils.percentToByte(level))
 		msg.append(0x0f)
 		msg.append(0x0f)
-		self.__write(msg)
-		
-	def setRgb(self, r,g,b, persist=True):
+		return msg
+
+	@staticmethod
+	def rgbMessage(r,g,b, persist=True):
 		if persist:
-			msg = bytearray([0x31])
+			return bytearray([0x31, r, g, b, 0x00, 0xf0, 0x0f])
 		else:
-			msg = bytearray([0x41])
-		msg.append(r)
-		msg.append(g)
-		msg.append(b)
-		msg.append(0x00)
-		msg.append(0xf0)
-		msg.append(0x0f)
-		self.__write(msg)
-
-	def setPresetPattern(self, pattern, speed):
+			return bytearray([0x41, r, g, b, 0x00, 0xf0, 0x0f])
 
-		PresetPattern.valtostr(pattern)
+	@staticmethod
+	def presetPatternMessage(pattern, speed):
 		if not PresetPattern.valid(pattern):
-			#print "Pattern must be between 0x25 and 0x38"
-			raise Exception
+			raise ValueError("Pattern must be between 0x25 and 0x38")
 
 		delay = utils.speedToDelay(speed)
-		#print "speed {}, delay 0x{:02x}".format(speed,delay)
 		pattern_set_msg = bytearray([0x61])
 		pattern_set_msg.append(pattern)
 		pattern_set_msg.append(delay)
 		pattern_set_msg.append(0x0f)
+		return pattern_set_msg
 
-		self.__write(pattern_set_msg)
+	@staticmethod
+	def timersRequest():
+		return bytearray([0x22, 0x2a, 0x2b, 0x0f])
 
-	def getTimers(self):
-		msg = bytearray([0x22, 0x2a, 0x2b, 0x0f])
-		self.__write(msg)
-		resp_len = 88
-		rx = self.__readResponse(resp_len)
-		if len(rx) != resp_len:
-			print "response too short!"
-			raise Exception
+	@staticmethod
+	def parseTimers(rx):
+		if len(rx) != LedProtocol.timers_length:
+			raise IOError("Timer response too short: {} of {} bytes".format(len(rx), LedProtocol.timers_length))
 			
 		#utils.dump_data(rx)
 		start = 2
@@ -621,49 +585,49 @@ class WifiLedBulb():
 		  start += 14
 		  
 		return timer_list
-				
-	def sendTimers(self, timer_list):
-		# remove inactive or expired timers from list
-		for t in timer_list:
-			if not t.isActive() or t.isExpired():
-				timer_list.remove(t)
+
+	@staticmethod
+	def timerTable(timer_list):
+		"""The six slots the bulb stores for timer_list, leaving timer_list itself alone"""
+		# blank out inactive or expired timers, keeping every other timer in its slot
+		table = [t if t.isActive() and not t.isExpired() else LedTimer() for t in timer_list]
 				
 		# truncate if more than 6
-		if len(timer_list) > 6:
-			print "too many timers, truncating list"
-			del timer_list[6:]
+		del table[6:]
 			
 		# pad list to 6 with inactive timers
-		if len(timer_list) != 6:
-			for i in range(6-len(timer_list)):
-				timer_list.append(LedTimer())
-		
+		while len(table) < 6:
+			table.append(LedTimer())
+		return table
+
+	@staticmethod
+	def timerTableBytes(table):
+		data = bytearray()
+		for t in table:
+			data.extend(t.toBytes())
+		return bytes(data)
+
+	@staticmethod
+	def sendTimersMessage(timer_list):
 		msg_start = bytearray([0x21])
 		msg_end = bytearray([0x00, 0xf0])
 		msg = bytearray()
 		
 		# build message
 		msg.extend(msg_start)
-		for t in timer_list:
-			msg.extend(t.toBytes())
+		msg.extend(LedProtocol.timerTableBytes(LedProtocol.timerTable(timer_list)))
 		msg.extend(msg_end)
-		self.__write(msg)
-		
-		# not sure what the resp is, prob some sort of ack?
-		rx = self.__readResponse(1)
-		rx = self.__readResponse(3)
-		
-	def setCustomPattern(self, rgb_list, speed, transition_type):
-				
+		return msg
+
+	@staticmethod
+	def customPatternMessage(rgb_list, speed, transition_type):
 		# truncate if more than 16
 		if len(rgb_list) > 16:
-			print "too many colors, truncating list"
 			del rgb_list[16:]
 			
 		# quit if too few
 		if len(rgb_list) == 0:
-			print "no colors, aborting"
-			return
+			raise ValueError("No colors given for custom pattern")
 		
 		msg = bytearray()
 		
@@ -696,25 +660,344 @@ class WifiLedBulb():
 			msg.append(0x3a)
 		msg.append(0xff)
 		msg.append(0x0f)
+		return msg
+
+class BulbState():
+	"""What is known of a bulb's state, kept up to date from both the commands
+	sent to it and the state it reports.  Fields are None until known."""
+
+	def __init__(self):
+		self.power = None
+		# "color", "ww", "preset", "custom" or "unknown"
+		self.mode = None
+		self.rgb = None
+		self.ww_level = None
+		self.pattern = None
+		self.delay = None
+		self.custom_colors = None
+		self.timers = None
+		# the last mode setting message sent, while the bulb is known to still show it
+		self.mode_packet = None
+		self.updated = None
+
+	@property
+	def speed(self):
+		if self.delay is None:
+			return None
+		return utils.delayToSpeed(self.delay)
+
+	def isOn(self):
+		return bool(self.power)
+
+	def age(self):
+		if self.updated is None:
+			return None
+		return time.time() - self.updated
+
+	def modeKey(self):
+		# what a state response says about the mode; speed only matters for patterns
+		delay = self.delay if self.mode in ["preset", "custom"] else None
+		return (self.mode, self.rgb, self.ww_level, self.pattern, delay)
+
+	def updateFromResponse(self, rx):
+		before = self.modeKey()
+		power_state = rx[2]
+		if power_state == 0x23:
+			self.power = True
+		elif power_state == 0x24:
+			self.power = False
+		else:
+			self.power = None
+
+		self.pattern = rx[3]
+		self.delay = rx[5]
+		self.mode = LedProtocol.determineMode(rx[9], self.pattern)
+		self.rgb = None
+		self.ww_level = None
+		if self.mode == "color":
+			self.rgb = (rx[6], rx[7], rx[8])
+		elif self.mode == "ww":
+			self.ww_level = utils.byteToPercent(rx[9])
+		if self.mode != "custom":
+			self.custom_colors = None
+		if self.modeKey() != before:
+			# changed by someone else, so the last message sent is no longer showing
+			self.mode_packet = None
+		self.updated = time.time()
+
+	def updateFromMessage(self, packet):
+		"""Records the effect of a command message sent to the bulb"""
+		packet = bytearray(packet)
+		code = packet[0]
+		if code == 0x71:
+			self.power = packet[1] == 0x23
+			return
+		if code in [0x31, 0x41]:
+			# stored and volatile colour/warm white
+			self.pattern = 0x61 if code == 0x31 else 0x62
+			self.delay = None
+			if packet[4] != 0:
+				self.mode = "ww"
+				self.rgb = None
+				self.ww_level = utils.byteToPercent(packet[4])
+			else:
+				self.mode = "color"
+				self.rgb = (packet[1], packet[2], packet[3])
+				self.ww_level = None
+		elif code == 0x61:
+			self.mode = "preset"
+			self.pattern = packet[1]
+			self.delay = packet[2]
+			self.rgb = None
+			self.ww_level = None
+		elif code == 0x51:
+			self.mode = "custom"
+			self.pattern = 0x60
+			self.delay = packet[65]
+			self.rgb = None
+			self.ww_level = None
+			colors = []
+			for i in range(16):
+				slot = packet[i*4:i*4+4]
+				if i > 0 and slot == bytearray([0, 1, 2, 3]):
+					break
+				colors.append((slot[1], slot[2], slot[3]))
+			self.custom_colors = colors
+		else:
+			return
+		self.mode_packet = bytes(packet)
+
+	def __str__(self):
+		if self.updated is None and self.mode is None:
+			return ""
+		if self.power is True:
+			power_str = "ON "
+		elif self.power is False:
+			power_str = "OFF"
+		else:
+			power_str = "Unknown power state"
+
+		if self.mode == "color":
+			color_str = utils.color_tuple_to_string(self.rgb)
+			mode_str = "Color: {}".format(color_str)
+		elif self.mode == "ww":
+			mode_str = "Warm White: {}%".format(self.ww_level)
+		elif self.mode == "preset":
+			pat = PresetPattern.valtostr(self.pattern)
+			mode_str = "Pattern: {} (Speed {}%)".format(pat, self.speed)
+		elif self.mode == "custom":
+			mode_str = "Custom pattern (Speed {}%)".format(self.speed)
+		else:
+			mode_str = "Unknown mode 0x{:x}".format(self.pattern or 0)
+		if self.pattern == 0x62:
+			mode_str += " (tmp)"
+		return "{} [{}]".format(power_str, mode_str)
+
+class SceneRegistry():
+	"""Named scenes, each parsed and encoded once into a checksummed packet, so
+	applying a scene is a single write of precomputed bytes."""
+
+	def __init__(self):
+		self.packets = dict()
+
+	def __contains__(self, name):
+		return name in self.packets
+
+	def names(self):
+		return sorted(self.packets.keys())
+
+	def get(self, name):
+		return self.packets[name]
+
+	def add(self, name, msg):
+		self.packets[name] = bytes(LedProtocol.addChecksum(bytearray(msg)))
+
+	def addColor(self, name, color, persist=True):
+		r,g,b = SceneRegistry.parseColor(color)
+		self.add(name, LedProtocol.rgbMessage(r, g, b, persist))
+
+	def addWarmWhite(self, name, level, persist=True):
+		self.add(name, LedProtocol.warmWhiteMessage(level, persist))
+
+	def addPreset(self, name, pattern, speed):
+		self.add(name, LedProtocol.presetPatternMessage(pattern, speed))
 
-		self.__write(msg)	
+	def addCustom(self, name, colors, speed, transition_type):
+		rgb_list = [SceneRegistry.parseColor(c) for c in colors]
+		self.add(name, LedProtocol.customPatternMessage(rgb_list, speed, transition_type))
+
+	@staticmethod
+	def parseColor(color):
+		rgb = utils.color_object_to_tuple(color)
+		if rgb is None:
+			raise ValueError("Invalid color value: {}".format(color))
+		return rgb
+
+# The arena's lighting scenes, shared by lights_engine and the --scene option
+scenes = SceneRegistry()
+scenes.addCustom('danger', [(255, 0, 0)], 120, 'strobe')
+scenes.addCustom('normal', [(0, 255, 0), (170, 0, 255)], 30, 'gradual')
+scenes.addCustom('charging', [(170, 0, 255), (255, 255, 0)], 200, 'gradual')
+
+class WifiLedBulb():
+	"""Keeps a BulbState for the bulb.  With suppress_writes, a mode or power
+	command that would not change the known state is not sent.  Reading the
+	state through getState() refreshes it from the bulb once it is older than
+	max_state_age seconds, and a command is only suppressed against state that
+	fresh, so a bulb changed from the app or a remote is set again.  With
+	max_state_age None the known state never expires; startRefresh() refreshes
+	it periodically instead."""
+
+	def __init__(self, ipaddr, port=5577, timeout=5, suppress_writes=True, max_state_age=30):
+		self.ipaddr = ipaddr
+		self.port = port
+		self.timeout = timeout
+		self.suppress_writes = suppress_writes
+		self.max_state_age = max_state_age
+		self.state = BulbState()
+		self.writes_suppressed = 0
+		# a command and its response must not interleave with the refresh thread's
+		self.lock = threading.RLock()
+		self.refreshing = False
+		
+		# with a timeout, a bulb that drops off the network raises socket.timeout instead of hanging
+		self.socket = socket.create_connection((self.ipaddr, self.port), self.timeout)
+		
+		#self.refreshState()
+
+	def refreshState(self):
+		with self.lock:
+			self.__write(LedProtocol.stateRequest())
+			rx = self.__readResponse(LedProtocol.state_length)
+			self.state.updateFromResponse(rx)
+		return self.state
+
+	def getState(self):
+		age = self.state.age()
+		if self.max_state_age is not None and (age is None or age > self.max_state_age):
+			self.refreshState()
+		return self.state
+
+	def startRefresh(self, interval):
+		self.refreshing = True
+		thread = threading.Thread(target=self.refreshLoop, args=(interval,))
+		thread.daemon = True
+		thread.start()
+
+	def stopRefresh(self):
+		self.refreshing = False
+
+	def refreshLoop(self, interval):
+		while self.refreshing:
+			try:
+				self.refreshState()
+			except socket.error:
+				pass
+			time.sleep(interval)
+
+	def __str__(self):
+		return str(self.state)
+
+	def getClock(self):
+		with self.lock:
+			self.__write(LedProtocol.clockRequest())
+			rx = self.__readResponse(LedProtocol.clock_length)
+		#self.dump_data(rx)
+		return LedProtocol.parseClock(rx)
+
+	def setClock(self):
+		self.__write(LedProtocol.setClockMessage())
+
+	def turnOn(self, on=True):
+		with self.lock:
+			if self.suppress_writes and self.state.power == on and self.getState().power == on:
+				self.writes_suppressed += 1
+				return
+			self.__writeMode(LedProtocol.powerMessage(on))
+		#print "set bulb {}".format(on)
+		#time.sleep(.5)
+		#x = self.__readResponse(4)
+		
+	def isOn(self):
+		return self.state.isOn()
+	
+	def turnOff(self):
+		self.turnOn(False)
+	
+	def setWarmWhite(self, level, persist=True):
+		self.__writeMode(LedProtocol.warmWhiteMessage(level, persist))
+		
+	def setRgb(self, r,g,b, persist=True):
+		self.__writeMode(LedProtocol.rgbMessage(r, g, b, persist))
+
+	def setPresetPattern(self, pattern, speed):
+		self.__writeMode(LedProtocol.presetPatternMessage(pattern, speed))
+
+	def getTimers(self, use_cache=False):
+		if not use_cache or self.state.timers is None:
+			with self.lock:
+				self.__write(LedProtocol.timersRequest())
+				rx = self.__readResponse(LedProtocol.timers_length)
+			self.state.timers = LedProtocol.parseTimers(rx)
+		# copies, so callers can edit them without touching the cache
+		return [LedTimer(t.toBytes()) for t in self.state.timers]
+				
+	def sendTimers(self, timer_list):
+		table = LedProtocol.timerTable(timer_list)
+		with self.lock:
+			self.__write(LedProtocol.sendTimersMessage(table))
+			
+			# not sure what the resp is, prob some sort of ack?
+			rx = self.__readResponse(1)
+			rx = self.__readResponse(3)
+		# copies, so later edits to the caller's timers are not mistaken for the bulb's table
+		self.state.timers = [LedTimer(t.toBytes()) for t in table]
+
+	def updateTimers(self, timer_list):
+		"""Sends timer_list unless the bulb is known to hold the same table already.
+		Returns whether it was sent."""
+		table = LedProtocol.timerTable(timer_list)
+		if self.state.timers is not None and LedProtocol.timerTableBytes(table) == LedProtocol.timerTableBytes(self.state.timers):
+			self.writes_suppressed += 1
+			return False
+		self.sendTimers(table)
+		return True
+		
+	def setCustomPattern(self, rgb_list, speed, transition_type):
+		self.__writeMode(LedProtocol.customPatternMessage(rgb_list, speed, transition_type))
+
+	def applyScene(self, packet):
+		# packet is a precomputed, checksummed message from a SceneRegistry
+		self.__writeMode(packet, checksummed=True)
+
+	def __writeMode(self, msg, checksummed=False):
+		if not checksummed:
+			LedProtocol.addChecksum(msg)
+		# held throughout, so the refresh thread cannot change the state between the check and the write
+		with self.lock:
+			if self.suppress_writes and bytes(msg) == self.state.mode_packet and bytes(msg) == self.getState().mode_packet:
+				self.writes_suppressed += 1
+				return
+			self.__writeRaw(msg)
+			self.state.updateFromMessage(msg)
 
 	def __writeRaw(self, bytes):
-		self.socket.send(bytes)
+		with self.lock:
+			self.socket.sendall(bytes)
 
 	def __write(self, bytes):
-		# calculate checksum of byte array and add to end
-		csum = sum(bytes) & 0xFF
-		bytes.append(csum)
+		LedProtocol.addChecksum(bytes)
 		#print "-------------",utils.dump_bytes(bytes)
 		self.__writeRaw(bytes)
-		#time.sleep(.4)		
 		
 	def __readResponse(self, expected):
 		remaining = expected
 		rx = bytearray()
 		while remaining > 0:
 			chunk = self.__readRaw(remaining)
+			if len(chunk) == 0:
+				# recv only returns nothing once the bulb has closed the connection
+				raise socket.error("Connection closed by bulb at {}".format(self.ipaddr))
 			remaining -= len(chunk)
 			rx.extend(chunk)
 		return rx
@@ -723,59 +1006,253 @@ class WifiLedBulb():
 		rx = self.socket.recv(byte_count)
 		return rx
 	
+	
+# Outcome of one bulb's part in a BulbGroup call: error is None on success, latency is in seconds
+BulbResult = namedtuple('BulbResult', ['ipaddr', 'result', 'error', 'latency'])
+
+class BulbGroup():
+	"""Holds connections to several bulbs and sends each command to all of them
+	at once, one thread per bulb, so a command to N bulbs costs about one round
+	trip rather than N.  Every call returns a BulbResult per bulb, in the order
+	the addresses were given.
+
+	Calls are expected to come from one thread at a time."""
+
+	def __init__(self, addrs, port=5577, timeout=5):
+		self.addrs = list(addrs)
+		self.port = port
+		self.timeout = timeout
+		self.bulbs = dict((addr, None) for addr in self.addrs)
+
+	def __len__(self):
+		return len(self.addrs)
+
+	def connect(self):
+		return self.run(lambda bulb: None)
+
+	def close(self):
+		for addr in self.addrs:
+			self.disconnect(addr)
+
+	def disconnect(self, addr):
+		bulb = self.bulbs[addr]
+		self.bulbs[addr] = None
+		if bulb is not None:
+			try:
+				bulb.socket.close()
+			except socket.error:
+				pass
+
+	def runOne(self, addr, func, args, results, index):
+		start = time.time()
+		result = None
+		error = None
+		# A stale connection often only shows up on write, so try a fresh one once
+		for attempt in range(2):
+			try:
+				if self.bulbs[addr] is None:
+					self.bulbs[addr] = WifiLedBulb(addr, self.port, self.timeout)
+				result = func(self.bulbs[addr], *args)
+				error = None
+				break
+			except socket.error as e:
+				error = e
+				self.disconnect(addr)
+			except Exception as e:
+				# e.g. a ValueError for a bad pattern; the connection is fine, so don't retry
+				error = e
+				break
+		results[index] = BulbResult(addr, result, error, time.time() - start)
+
+	def run(self, func, *args):
+		"""Calls func(bulb, *args) for every bulb concurrently"""
+		results = [None] * len(self.addrs)
+		threads = []
+		for index, addr in enumerate(self.addrs):
+			thread = threading.Thread(target=self.runOne, args=(addr, func, args, results, index))
+			thread.daemon = True
+			thread.start()
+			threads.append(thread)
+		for thread in threads:
+			thread.join()
+		return results
+
+	def broadcast(self, method, *args):
+		"""Calls the named WifiLedBulb method on every bulb concurrently"""
+		return self.run(lambda bulb, *args: getattr(bulb, method)(*args), *args)
+
+	def turnOn(self, on=True):
+		return self.broadcast('turnOn', on)
+
+	def turnOff(self):
+		return self.broadcast('turnOff')
+
+	def setRgb(self, r,g,b, persist=True):
+		return self.broadcast('setRgb', r, g, b, persist)
+
+	def setWarmWhite(self, level, persist=True):
+		return self.broadcast('setWarmWhite', level, persist)
+
+	def setPresetPattern(self, pattern, speed):
+		return self.broadcast('setPresetPattern', pattern, speed)
+
+	def setCustomPattern(self, rgb_list, speed, transition_type):
+		# each bulb gets its own copy, customPatternMessage truncates in place
+		return self.run(lambda bulb: bulb.setCustomPattern(list(rgb_list), speed, transition_type))
+
+	def refreshState(self):
+		return self.broadcast('refreshState')
+
+	def applyScene(self, packet):
+		return self.broadcast('applyScene', packet)
+	
+class TimerManager():
+	"""Programs timers on every bulb of a BulbGroup concurrently.  Timer tables
+	are cached per bulb, so changing a slot only reads the table the first
+	time, and a bulb whose table would not change is not written to.  Each
+	call returns a BulbResult per bulb; for updates the result says whether
+	anything was sent."""
+
+	def __init__(self, group):
+		self.group = group
+
+	def getTimers(self, refresh=False):
+		return self.group.run(lambda bulb: bulb.getTimers(use_cache=not refresh))
+
+	def setTimers(self, timer_list):
+		return self.group.run(lambda bulb: bulb.updateTimers(timer_list))
+
+	def setTimer(self, num, timer):
+		"""Sets timer slot num (1-6) on every bulb, keeping the other slots"""
+		def program(bulb):
+			timers = bulb.getTimers(use_cache=True)
+			timers[num-1] = timer
+			return bulb.updateTimers(timers)
+		return self.group.run(program)
+
 class  BulbScanner():
-	def __init__(self):
+	"""Finds bulbs with a UDP broadcast.  Replies are de-duplicated by bulb id and
+	kept in a cache for ttl seconds, so resolving a known bulb by id does not
+	need the network.  start() keeps the cache fresh from a background thread."""
+
+	DISCOVERY_PORT = 48899
+	discovery_msg = b"HF-A11ASSISTHREAD"
+
+	def __init__(self, ttl=300):
+		self.ttl = ttl
 		self.found_bulbs = []
+		# bulb id -> (info dict, time last seen)
+		self.cache = dict()
+		self.lock = threading.Lock()
+		self.running = False
+		self.thread = None
 	
 	def getBulbInfoByID(self, id):
 		bulb_info = None
-		for b in self.found_bulbs:
-			if b['id'] == id:
-				return b
-		return b		
+		with self.lock:
+			if id in self.cache:
+				info, seen = self.cache[id]
+				if time.time() - seen < self.ttl:
+					bulb_info = info
+				else:
+					del self.cache[id]
+		return bulb_info
 
 	def getBulbInfo(self):
-		return self.found_bulbs	
-	
-	def scan(self, timeout=10):
-		
-		DISCOVERY_PORT = 48899
-	
+		return self.found_bulbs
+
+	def resolve(self, id, timeout=3):
+		"""Returns the cached info for the bulb, scanning for it if needed"""
+		bulb_info = self.getBulbInfoByID(id)
+		if bulb_info is None:
+			self.scan(timeout, expected=[id])
+			bulb_info = self.getBulbInfoByID(id)
+		return bulb_info
+
+	def start(self, interval=60):
+		self.running = True
+		self.thread = threading.Thread(target=self.run, args=(interval,))
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.running = False
+
+	def run(self, interval):
+		while self.running:
+			try:
+				self.scan(timeout=5)
+			except Exception as e:
+				# keep the cache refreshing whatever went wrong with this scan
+				logging.error("Bulb discovery failed: {}".format(e))
+			time.sleep(interval)
+
+	def scan(self, timeout=10, expected=None, quiet_time=1, resend_interval=1):
+		"""Returns once every id in expected has replied, once no new bulb has
+		replied for quiet_time seconds after the first one did, or after timeout"""
+
+		# an ephemeral port, so scans don't collide; bulbs reply to the sender
 		sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-		sock.bind(('', DISCOVERY_PORT))
+		sock.bind(('', 0))
 		sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
 		
-		msg = "HF-A11ASSISTHREAD"
+		msg = self.discovery_msg
 		
 		# set the time at which we will quit the search
 		quit_time = time.time() + timeout
+		next_send = time.time()
+		last_new = None
 
+		found = dict()
 		response_list = []
-		# outer loop for query send
-		while True:
-			if time.time() > quit_time:
-				break			
-			# send out a broadcast query
-			sock.sendto(msg, ('<broadcast>', DISCOVERY_PORT))
-			
-			# inner loop waiting for responses
+		try:
 			while True:
-				
-				sock.settimeout(1)
+				now = time.time()
+				if now >= quit_time:
+					break
+				if last_new is not None and now - last_new >= quiet_time:
+					break
+				if now >= next_send:
+					# send out a broadcast query, again every resend_interval in case it was lost
+					sock.sendto(msg, ('<broadcast>', self.DISCOVERY_PORT))
+					next_send = now + resend_interval
+
+				wait_until = min(quit_time, next_send)
+				if last_new is not None:
+					wait_until = min(wait_until, last_new + quiet_time)
+				sock.settimeout(max(wait_until - now, 0.01))
 				try:
 					data, addr = sock.recvfrom(64)
 				except socket.timeout:
-					data = None
-					if time.time() > quit_time:
-						break
-	
-				if data is not None and data != msg:
-					# tuples of IDs and IP addresses
-					item = dict()
-					item['ipaddr'] = data.split(',')[0]
-					item['id'] = data.split(',')[1]
-					item['model'] = data.split(',')[2]
-					response_list.append(item)
+					continue
+
+				if data == msg:
+					continue
+				# tuples of IDs and IP addresses
+				try:
+					fields = data.decode('ascii').split(',')
+				except UnicodeDecodeError:
+					# not a bulb reply
+					continue
+				if len(fields) < 3:
+					continue
+				item = dict()
+				item['ipaddr'] = fields[0]
+				item['id'] = fields[1]
+				item['model'] = fields[2]
+
+				with self.lock:
+					self.cache[item['id']] = (item, time.time())
+				if item['id'] in found:
+					continue
+				found[item['id']] = item
+				response_list.append(item)
+				last_new = time.time()
+
+				if expected and all(id in found for id in expected):
+					break
+		finally:
+			sock.close()
 
 		self.found_bulbs = response_list
 		return response_list
@@ -828,7 +1305,7 @@ Deactivate timer #4:
 Use --timerhelp for more details on setting timers
 	"""
 	
-	print example_text.replace("%prog%",sys.argv[0])
+	print(example_text.replace("%prog%",sys.argv[0]))
 
 def showTimerHelp():
 	timerhelp_text = """
@@ -892,7 +1369,7 @@ Example setting strings:
 	"time:0345;date:2015-08-11;level:100"
 	"""
 	
-	print timerhelp_text
+	print(timerhelp_text)
 	
 def processSetTimerArgs(parser, args):
 	mode = args[1]
@@ -1092,6 +1569,9 @@ def parseArgs():
 	mode_group.add_option("-p", "--preset", dest="preset", default=None,
 				  help="Set preset pattern mode (SPEED is percent)",
 				  metavar='CODE SPEED', type="int", nargs=2)
+	mode_group.add_option("--scene", dest="scene", default=None,
+				  help="Set a named scene: " + ", ".join(scenes.names()),
+				  metavar='NAME')
 	mode_group.add_option("-C", "--custom", dest="custom", metavar='TYPE SPEED COLORLIST',
 							default=None, nargs=3, 
 							help="Set custom pattern mode. " +
@@ -1138,17 +1618,17 @@ def parseArgs():
 	
 	if options.listpresets:
 		for c in range(PresetPattern.seven_color_cross_fade, PresetPattern.seven_color_jumping+1):
-			print "{:2} {}".format(c, PresetPattern.valtostr(c))
+			print("{:2} {}".format(c, PresetPattern.valtostr(c)))
 		sys.exit(0)
 
 	global webcolors_available
 	if options.listcolors:
 		if webcolors_available:
 			for c in utils.get_color_names_list():
-				print "{}, ".format(c),
-			print
+				print("{}, ".format(c), end=" ")
+			print()
 		else:
-			print "webcolors package doesn't seem to be installed. No color names available"
+			print("webcolors package doesn't seem to be installed. No color names available")
 		sys.exit(0)		
 		
 	if options.settimer:
@@ -1162,8 +1642,9 @@ def parseArgs():
 	if options.ww:     mode_count += 1
 	if options.preset: mode_count += 1
 	if options.custom: mode_count += 1
+	if options.scene:  mode_count += 1
 	if mode_count > 1:
-		parser.error("options --color, --warmwhite, --preset, and --custom are mutually exclusive")
+		parser.error("options --color, --warmwhite, --preset, --custom and --scene are mutually exclusive")
 		
 	if options.on and options.off:
 		parser.error("options --on and --off are mutually exclusive")
@@ -1179,6 +1660,10 @@ def parseArgs():
 	if options.preset:
 		if not PresetPattern.valid(options.preset[0]):
 			parser.error("Preset code is not in range")
+
+	if options.scene:
+		if options.scene not in scenes:
+			parser.error("Unknown scene, choose from: {}".format(", ".join(scenes.names())))
 		
 	# asking for timer info, implicitly gets the state
 	if options.showtimers:
@@ -1204,10 +1689,70 @@ def parseArgs():
 
 	return (options, args)
 #-------------------------------------------
-def main():
-	
-	(options, args) = parseArgs()
-	
+def runOperations(bulb, info, options):
+	"""Perform the operations selected on the command line on one bulb"""
+	if options.getclock:
+		print("{} [{}] {}".format(info['id'], info['ipaddr'],bulb.getClock()))
+
+	if options.setclock:
+		bulb.setClock()
+		
+	if options.ww is not None:
+		print("Setting warm white mode, level: {}%".format(options.ww))
+		bulb.setWarmWhite(options.ww, not options.volatile)
+		
+	elif options.color is not None:
+		print("Setting color RGB:{}".format(options.color), end=" ")
+		name = utils.color_tuple_to_string(options.color)
+		if name is None:
+			print()
+		else:
+			print("[{}]".format(name))
+		bulb.setRgb(options.color[0],options.color[1],options.color[2], not options.volatile)
+		
+	elif options.custom is not None:
+		bulb.setCustomPattern(options.custom[2], options.custom[1], options.custom[0])
+		print("Setting custom pattern: {}, Speed={}%, {}".format(
+			options.custom[0], options.custom[1], options.custom[2]))
+		
+	elif options.preset is not None:
+		print("Setting preset pattern: {}, Speed={}%".format(PresetPattern.valtostr(options.preset[0]), options.preset[1]))
+		bulb.setPresetPattern(options.preset[0], options.preset[1])
+
+	elif options.scene is not None:
+		print("Setting scene: {}".format(options.scene))
+		bulb.applyScene(scenes.get(options.scene))
+
+	if options.on:
+		print("Turning on bulb at {}".format(bulb.ipaddr))
+		bulb.turnOn()
+	elif options.off:
+		print("Turning off bulb at {}".format(bulb.ipaddr))
+		bulb.turnOff()
+		
+	if options.info:
+		bulb.refreshState()
+		print("{} [{}] {}".format(info['id'], info['ipaddr'],bulb))
+
+	if options.settimer:
+		num = int(options.settimer[0])
+		print("New Timer ---- #{}: {}".format(num,options.new_timer))
+		if options.new_timer.isExpired():
+			print("[timer is already expired, will be deactivated]")
+		timers = bulb.getTimers(use_cache=True)
+		timers[num-1] = options.new_timer
+		if not bulb.updateTimers(timers):
+			print("Timers on bulb at [{}] already up to date".format(bulb.ipaddr))
+
+	if options.showtimers:
+		timers = bulb.getTimers(use_cache=True)
+		num = 0
+		for t in timers:
+			num += 1
+			print("  Timer #{}: {}".format(num,t))
+		print("")
+
+def getBulbInfoList(options, args):
 	if options.scan:
 		scanner = BulbScanner()
 		scanner.scan(timeout=2)
@@ -1218,9 +1763,9 @@ def main():
 			for b in bulb_info_list:
 				addrs.append(b['ipaddr'])
 		else:
-			print "{} bulbs found".format(len(bulb_info_list))
+			print("{} bulbs found".format(len(bulb_info_list)))
 			for b in bulb_info_list:
-				print "  {} {}".format(b['id'], b['ipaddr'])
+				print("  {} {}".format(b['id'], b['ipaddr']))
 			sys.exit(0)
 		
 	else:
@@ -1231,73 +1776,23 @@ def main():
 			info['ipaddr'] = addr
 			info['id'] = 'Unknown ID'
 			bulb_info_list.append(info)
-			
-	
-	# now we have our bulb list, perform same operation on all of them
-	for info in bulb_info_list:
-		a = info['ipaddr']
-		try:
-			bulb = WifiLedBulb(info['ipaddr'])
-		except Exception as e:
-			print "Unable to connect to bulb at [{}]: {}".format(info['ipaddr'],e)
-			continue
+	return bulb_info_list
 
-		if options.getclock:
-			print "{} [{}] {}".format(info['id'], info['ipaddr'],bulb.getClock())
+#-------------------------------------------
+def main():
+	
+	(options, args) = parseArgs()
+	bulb_info_list = getBulbInfoList(options, args)
+	
+	# connect to all of them at once, then perform same operation on each
+	group = BulbGroup([info['ipaddr'] for info in bulb_info_list])
+	for info, result in zip(bulb_info_list, group.connect()):
+		if result.error is not None:
+			print("Unable to connect to bulb at [{}]: {}".format(info['ipaddr'],result.error))
 
-		if options.setclock:
-			bulb.setClock()
-			
-		if options.ww is not None:
-			print "Setting warm white mode, level: {}%".format(options.ww)
-			bulb.setWarmWhite(options.ww, not options.volatile)
-			
-		elif options.color is not None:
-			print "Setting color RGB:{}".format(options.color),
-			name = utils.color_tuple_to_string(options.color)
-			if name is None:
-				print 
-			else:
-				print "[{}]".format(name)	
-			bulb.setRgb(options.color[0],options.color[1],options.color[2], not options.volatile)
-			
-		elif options.custom is not None:
-			bulb.setCustomPattern(options.custom[2], options.custom[1], options.custom[0])
-			print "Setting custom pattern: {}, Speed={}%, {}".format(
-				options.custom[0], options.custom[1], options.custom[2])
-			
-		elif options.preset is not None:
-			print "Setting preset pattern: {}, Speed={}%".format(PresetPattern.valtostr(options.preset[0]), options.preset[1])
-			bulb.setPresetPattern(options.preset[0], options.preset[1])
-
-		if options.on:
-			print "Turning on bulb at {}".format(bulb.ipaddr)
-			bulb.turnOn()
-		elif options.off:
-			print "Turning off bulb at {}".format(bulb.ipaddr)
-			bulb.turnOff()
-			
-		if options.info:
-			bulb.refreshState()
-			print "{} [{}] {}".format(info['id'], info['ipaddr'],bulb)
-
-		if options.settimer:
-			timers = bulb.getTimers()
-			num = int(options.settimer[0])
-			print "New Timer ---- #{}: {}".format(num,options.new_timer)
-			if options.new_timer.isExpired():
-				print "[timer is already expired, will be deactivated]"
-			timers[num-1] = options.new_timer 
-			bulb.sendTimers(timers)
-			
-		if options.showtimers:
-			timers = bulb.getTimers()
-			num = 0
-			for t in timers:
-				num += 1
-				print "  Timer #{}: {}".format(num,t)
-			print ""
-			
+	for info in bulb_info_list:
+		if group.bulbs[info['ipaddr']] is not None:
+			runOperations(group.bulbs[info['ipaddr']], info, options)
 
 	sys.exit(0)
 
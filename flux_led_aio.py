@@ -0,0 +1,199 @@
+'''Asyncio client for Flux WiFi LED bulbs, with the same operations as
+   flux_led.WifiLedBulb.
+
+   Commands are queued and written back to back without waiting for earlier
+   responses. The bulb answers in order, so each response is matched to the
+   oldest request still waiting for one. A connection that fails or times out
+   is dropped, every request waiting on it fails, and the next command opens
+   a new one.'''
+
+import asyncio
+import collections
+from flux_led import BulbState, LedProtocol, LedTimer
+
+
+class BulbError(IOError):
+    pass
+
+
+class AsyncWifiLedBulb:
+
+    def __init__(self, ipaddr, port=5577, connect_timeout=3, read_timeout=2, max_pending=16,
+                 suppress_writes=True, max_state_age=30):
+        self.ipaddr = ipaddr
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.queue = asyncio.Queue(max_pending)
+        self.reader = None
+        self.writer = None
+        # (reader, expected, future) for requests written but not yet answered
+        self.awaiting = collections.deque()
+        self.response_ready = asyncio.Event()
+        # Same state tracking and write suppression as WifiLedBulb
+        self.state = BulbState()
+        self.suppress_writes = suppress_writes
+        self.max_state_age = max_state_age
+        self.writes_suppressed = 0
+        self.connects = 0
+        self.write_task = asyncio.ensure_future(self.write_loop())
+        self.read_task = asyncio.ensure_future(self.read_loop())
+
+    def __str__(self):
+        return str(self.state)
+
+    async def close(self):
+        for task in (self.write_task, self.read_task):
+            task.cancel()
+        self.disconnect(BulbError('Bulb client closed'))
+
+    async def send(self, msg, expected=0):
+        '''Queues msg and waits until it is written, or until its response of
+           expected bytes has been read'''
+        return await self.send_packet(LedProtocol.addChecksum(msg), expected)
+
+    async def send_packet(self, packet, expected=0):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((packet, expected, future))
+        return await future
+
+    async def send_mode(self, packet):
+        if (self.suppress_writes and bytes(packet) == self.state.mode_packet
+                and bytes(packet) == (await self.getState()).mode_packet):
+            self.writes_suppressed += 1
+            return
+        await self.send_packet(packet)
+        self.state.updateFromMessage(packet)
+
+    async def connect(self):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.ipaddr, self.port), self.connect_timeout)
+        except asyncio.TimeoutError:
+            raise BulbError('Timed out connecting to bulb at %s' % self.ipaddr)
+        self.connects += 1
+
+    def disconnect(self, error):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        while self.awaiting:
+            reader, expected, future = self.awaiting.popleft()
+            if not future.done():
+                future.set_exception(error)
+
+    async def write_loop(self):
+        while True:
+            msg, expected, future = await self.queue.get()
+            if future.done():
+                continue
+            # A stale connection often only shows up on write, so try a fresh one once
+            for attempt in range(2):
+                try:
+                    if self.writer is None:
+                        await self.connect()
+                    self.writer.write(msg)
+                    await self.writer.drain()
+                    break
+                except (OSError, BulbError) as e:
+                    error = e
+                    self.disconnect(BulbError('Write to bulb at %s failed: %s' % (self.ipaddr, e)))
+            else:
+                future.set_exception(BulbError('Unable to reach bulb at %s: %s' % (self.ipaddr, error)))
+                continue
+
+            if expected:
+                self.awaiting.append((self.reader, expected, future))
+                self.response_ready.set()
+            else:
+                future.set_result(None)
+
+    async def read_loop(self):
+        while True:
+            if not self.awaiting:
+                self.response_ready.clear()
+                await self.response_ready.wait()
+                continue
+            reader, expected, future = self.awaiting[0]
+            try:
+                rx = await asyncio.wait_for(reader.readexactly(expected), self.read_timeout)
+            except asyncio.TimeoutError:
+                self.read_failed(reader, future, BulbError('Timed out waiting for bulb at %s' % self.ipaddr))
+                continue
+            except (OSError, asyncio.IncompleteReadError) as e:
+                # IncompleteReadError also covers the bulb closing the connection
+                self.read_failed(reader, future, BulbError('Read from bulb at %s failed: %s' % (self.ipaddr, e)))
+                continue
+            # disconnect may have run while this read was in progress
+            if self.awaiting and self.awaiting[0][2] is future:
+                self.awaiting.popleft()
+                if not future.done():
+                    future.set_result(bytearray(rx))
+
+    def read_failed(self, reader, future, error):
+        if reader is self.reader:
+            self.disconnect(error)
+            return
+        # A connection already replaced; only this request was waiting on it
+        if self.awaiting and self.awaiting[0][2] is future:
+            self.awaiting.popleft()
+        if not future.done():
+            future.set_exception(error)
+
+    async def refreshState(self):
+        rx = await self.send(LedProtocol.stateRequest(), LedProtocol.state_length)
+        self.state.updateFromResponse(rx)
+        return self.state
+
+    async def getState(self):
+        age = self.state.age()
+        if self.max_state_age is not None and (age is None or age > self.max_state_age):
+            await self.refreshState()
+        return self.state
+
+    def isOn(self):
+        return self.state.isOn()
+
+    async def getClock(self):
+        rx = await self.send(LedProtocol.clockRequest(), LedProtocol.clock_length)
+        return LedProtocol.parseClock(rx)
+
+    async def setClock(self):
+        await self.send(LedProtocol.setClockMessage())
+
+    async def turnOn(self, on=True):
+        if self.suppress_writes and self.state.power == on and (await self.getState()).power == on:
+            self.writes_suppressed += 1
+            return
+        await self.send_mode(LedProtocol.addChecksum(LedProtocol.powerMessage(on)))
+
+    async def turnOff(self):
+        await self.turnOn(False)
+
+    async def setWarmWhite(self, level, persist=True):
+        await self.send_mode(LedProtocol.addChecksum(LedProtocol.warmWhiteMessage(level, persist)))
+
+    async def setRgb(self, r, g, b, persist=True):
+        await self.send_mode(LedProtocol.addChecksum(LedProtocol.rgbMessage(r, g, b, persist)))
+
+    async def setPresetPattern(self, pattern, speed):
+        await self.send_mode(LedProtocol.addChecksum(LedProtocol.presetPatternMessage(pattern, speed)))
+
+    async def setCustomPattern(self, rgb_list, speed, transition_type):
+        await self.send_mode(LedProtocol.addChecksum(LedProtocol.customPatternMessage(rgb_list, speed, transition_type)))
+
+    async def applyScene(self, packet):
+        # packet is a precomputed, checksummed message from a SceneRegistry
+        await self.send_mode(packet)
+
+    async def getTimers(self):
+        rx = await self.send(LedProtocol.timersRequest(), LedProtocol.timers_length)
+        self.state.timers = LedProtocol.parseTimers(rx)
+        return [LedTimer(t.toBytes()) for t in self.state.timers]
+
+    async def sendTimers(self, timer_list):
+        table = LedProtocol.timerTable(timer_list)
+        await self.send(LedProtocol.sendTimersMessage(table), LedProtocol.send_timers_length)
+        # copies, so later edits to the caller's timers do not change the cache
+        self.state.timers = [LedTimer(t.toBytes()) for t in table]
@@ -1,24 +1,86 @@
-from subprocess import Popen, PIPE
+import logging
+import threading
+from flux_led import BulbGroup, BulbScanner, scenes
 
 class LightsEngine:
+    '''Keeps connections to the arena bulbs open and applies state changes on
+       a worker thread, sending to all bulbs at once, so callers never wait on
+       the network. If a bulb drops off the network its connection is reopened
+       and the latest state re-sent.'''
 
-    bulb_addr = '192.168.1.106'
+    bulb_addrs = ['192.168.1.106']
+    # Bulbs found by id at runtime, for bulbs without a fixed address
+    bulb_ids = []
+    retry_interval = 5
 
     def __init__(self):
         self.state = ''
+        self.bulbs = BulbGroup(self.bulb_addrs)
+        self.scanner = BulbScanner()
+        if self.bulb_ids:
+            self.scanner.start()
+        self.requested = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
         self.normal()
 
     def danger(self):
-        if (self.state != 'danger'):
-            ffmpeg_process = Popen(['C:\Python27\python.exe', 'flux_led.py', self.bulb_addr, '-C', 'strobe', '120', '255,0,0'], stdin=PIPE)
-            self.state = 'danger'
+        self.request('danger')
 
     def normal(self):
-        if (self.state != 'normal'):
-            ffmpeg_process = Popen(['C:\Python27\python.exe', 'flux_led.py', self.bulb_addr, '-C', 'gradual', '30', '0,255,0 170,0,255'], stdin=PIPE)
-            self.state = 'normal'
+        self.request('normal')
 
     def charging(self):
-        if (self.state != 'charging'):
-            ffmpeg_process = Popen(['C:\Python27\python.exe', 'flux_led.py', self.bulb_addr, '-C', 'gradual', '200', '170,0,255, 255,255,0'], stdin=PIPE)
-            self.state = 'charging'
\ No newline at end of file
+        self.request('charging')
+
+    def request(self, state):
+        with self.condition:
+            if (self.state != state):
+                self.state = state
+                self.requested = state
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.requested is None:
+                    self.condition.wait()
+                state = self.requested
+                self.requested = None
+
+            if not self.apply(state):
+                # Retry later unless a newer state has been requested meanwhile
+                with self.condition:
+                    if self.requested is None:
+                        self.condition.wait(self.retry_interval)
+                        if self.requested is None:
+                            self.requested = state
+
+    def resolve_bulbs(self):
+        '''Points the group at the current addresses, which only needs the
+           network the first time a bulb id is looked up or after it expires'''
+        addrs = list(self.bulb_addrs)
+        for bulb_id in self.bulb_ids:
+            info = self.scanner.resolve(bulb_id)
+            if info is None:
+                logging.error('Unable to find bulb %s' % bulb_id)
+            elif info['ipaddr'] not in addrs:
+                addrs.append(info['ipaddr'])
+        if addrs != self.bulbs.addrs:
+            self.bulbs.close()
+            self.bulbs = BulbGroup(addrs)
+
+    def apply(self, state):
+        self.resolve_bulbs()
+        applied = True
+        for result in self.bulbs.applyScene(scenes.get(state)):
+            if result.error is not None:
+                logging.error('Unable to set lights at %s to %s: %s' % (result.ipaddr, state, result.error))
+                applied = False
+        return applied
+
+    def disconnect(self):
+        self.scanner.stop()
+        self.bulbs.close()
\ No newline at end of file
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+# Desired motor output for the current key state
+MotorIntent = namedtuple('MotorIntent', ['l_wheel_speed', 'r_wheel_speed', 'head_vel', 'lift_vel'])
+
+
+class MotorController:
+    '''Fixed rate control loop. RPC handlers only record the latest intent with
+       set_intent; the loop picks it up once per tick and sends the robot only
+       the commands whose values changed since the last tick.
+
+       recover is called on the loop, before sending, whenever the driving
+       intent changed. It may move the robot itself (e.g. tilt recovery) and
+       returns True if it did, so the intent is then sent in full.'''
+
+    def __init__(self, robot, rate=20, recover=None):
+        self.robot = robot
+        self.period = 1.0 / rate
+        self.recover = recover
+        self.lock = threading.Lock()
+        self.sent = None
+        self.pending = None
+        self.driving_changed = False
+        self.running = False
+        self.thread = None
+
+        self.commands_sent = 0
+        self.intents_merged = 0
+        self.overruns = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def set_intent(self, intent, driving_changed=False):
+        with self.lock:
+            if self.pending is not None:
+                self.intents_merged += 1
+            self.pending = intent
+            self.driving_changed = self.driving_changed or driving_changed
+
+    def forget(self):
+        '''Called after something else has moved the motors, so the next intent is sent in full'''
+        with self.lock:
+            self.sent = None
+
+    def run(self):
+        next_tick = time.time()
+        while self.running:
+            try:
+                self.step()
+            except Exception as e:
+                logging.error('Motor control step failed: %s' % e)
+            next_tick += self.period
+            delay = next_tick - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Fell behind, e.g. during a recovery; start a fresh schedule
+                self.overruns += 1
+                next_tick = time.time()
+
+    def step(self):
+        with self.lock:
+            intent = self.pending
+            driving_changed = self.driving_changed
+            self.pending = None
+            self.driving_changed = False
+        if intent is None:
+            return
+
+        recovered = not driving_changed
+        # Fields are None for motors whose last command is unknown
+        sent = None
+        try:
+            if driving_changed and self.recover is not None and self.recover(intent):
+                self.forget()
+            recovered = True
+
+            with self.lock:
+                sent = self.sent or MotorIntent(None, None, None, None)
+
+            if (intent.l_wheel_speed, intent.r_wheel_speed) != (sent.l_wheel_speed, sent.r_wheel_speed):
+                self.robot.drive_wheels(intent.l_wheel_speed, intent.r_wheel_speed,
+                                        intent.l_wheel_speed*4, intent.r_wheel_speed*4)
+                self.commands_sent += 1
+                sent = sent._replace(l_wheel_speed=intent.l_wheel_speed, r_wheel_speed=intent.r_wheel_speed)
+            if intent.head_vel != sent.head_vel:
+                self.robot.move_head(intent.head_vel)
+                self.commands_sent += 1
+                sent = sent._replace(head_vel=intent.head_vel)
+            if intent.lift_vel != sent.lift_vel:
+                self.robot.move_lift(intent.lift_vel)
+                self.commands_sent += 1
+                sent = sent._replace(lift_vel=intent.lift_vel)
+        except Exception:
+            # Not applied (e.g. RobotBusy), so try it again next tick unless a newer intent has arrived.
+            # The motors that did take their command are not sent it again.
+            with self.lock:
+                if sent is not None:
+                    self.sent = sent
+                if self.pending is None:
+                    self.pending = intent
+                if not recovered:
+                    self.driving_changed = True
+            raise
+
+        with self.lock:
+            self.sent = intent
@@ -1,11 +1,15 @@
 import pygame as pg
 import time
 import os
+from io import BytesIO
 
 pg.mixer.init()
 pg.init()
 
 pg.mixer.set_num_channels(50)
+# Channel 0 is kept for speech, so effects never cut it off
+pg.mixer.set_reserved(1)
+speech_channel = pg.mixer.Channel(0)
 
 _sound_library = {}
 
@@ -53,4 +57,13 @@ def level_unlocked():
   play_sound("../sounds/level_unlocked.wav", 0, 1)
 
 def level_complete():
-  play_sound("../sounds/level_complete.wav", 0, 1)
\ No newline at end of file
+  play_sound("../sounds/level_complete.wav", 0, 1)
+
+def play_speech(data):
+  '''Plays rendered speech (WAV bytes), returning once it finishes or is stopped'''
+  speech_channel.play(pg.mixer.Sound(file=BytesIO(data)))
+  while speech_channel.get_busy():
+    time.sleep(0.02)
+
+def stop_speech():
+  speech_channel.stop()
\ No newline at end of file
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+class UnlockClient:
+    '''Sends round unlock attempts to the game backend over one pooled,
+       keep-alive session, so the TLS handshake with the client certificate
+       is made once per connection rather than once per guess.
+
+       Connect and read timeouts stop a slow backend from holding a chat
+       worker. Only failed connects are retried, since an attempt that
+       reached the backend may already have been counted.
+
+       Keeps the latency of recent attempts, failed ones included, and a count
+       of failures, and prints a summary at most every stats_interval seconds.'''
+
+    url = 'https://game.playperception.com/game/attemptunlockround/'
+    url_local = 'https://game.localhost/game/attemptunlockround/'
+    cert = ('certs/client.crt', 'certs/client.key')
+    # Send attempts to url_local instead of url
+    use_local = False
+    connect_timeout = 3
+    read_timeout = 5
+    connect_retries = 2
+    # Connections kept open; also the number of attempts that can run at once
+    pool_size = 2
+    stats_interval = 60
+
+    def __init__(self, use_local=None):
+        if use_local is None:
+            use_local = self.use_local
+        self.endpoint = self.url_local if use_local else self.url
+        self.session = requests.Session()
+        self.session.cert = self.cert
+        retries = Retry(total=self.connect_retries, connect=self.connect_retries, read=0, redirect=0,
+                        backoff_factor=0.1)
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size,
+                                                   max_retries=retries, pool_block=True))
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=100)
+        self.attempts = 0
+        self.failures = 0
+        self.last_report = time.time()
+
+    def attempt(self, text):
+        '''Returns True if text unlocks the current round. Raises
+           requests.RequestException if the backend can't be reached in time,
+           or ValueError if its reply can't be read.'''
+        start = time.time()
+        try:
+            # verify is passed per request as REQUESTS_CA_BUNDLE would override it on the session
+            r = self.session.post(self.endpoint, json={'attempt': text}, verify=False,
+                                  timeout=(self.connect_timeout, self.read_timeout))
+            unlocked = False
+            if r.status_code == 202:
+                reply = r.json()
+                if 'unlocked' not in reply:
+                    raise ValueError('No unlocked in reply %s' % reply)
+                unlocked = reply['unlocked']
+        except (requests.RequestException, ValueError) as e:
+            logging.error('Unlock attempt at %s failed: %s' % (self.endpoint, e))
+            self.record(start, failed=True)
+            raise
+        self.record(start)
+        return unlocked
+
+    def record(self, start, failed=False):
+        now = time.time()
+        with self.lock:
+            self.attempts += 1
+            if failed:
+                self.failures += 1
+            self.latencies.append(now - start)
+            report = now - self.last_report >= self.stats_interval
+            if report:
+                self.last_report = now
+        if report:
+            print('Unlock attempts: %(attempts)d, failures: %(failures)d, latency: %(latency).3fs, '
+                  'max: %(max_latency).3fs' % self.stats())
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            attempts = self.attempts
+            failures = self.failures
+        latency = 0
+        max_latency = 0
+        if latencies:
+            latency = latencies[len(latencies) // 2]
+            max_latency = latencies[-1]
+        return {'attempts': attempts, 'failures': failures, 'latency': latency, 'max_latency': max_latency}
+
+    def close(self):
+        self.session.close()
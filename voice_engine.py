@@ -1,17 +1,420 @@
-import subprocess, sys
+import base64
+import hashlib
+import itertools
+import logging
+import queue
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+import sound_engine
 
 MALE = 'Microsoft David Desktop'
 FEMALE = 'Microsoft Hazel Desktop'
+# Cozmo's own speaker, given a backend by control.RemoteControlCozmo
+ROBOT = 'Cozmo'
 
-def speak(voice, speech):
+# Utterance priorities, spoken lowest first
+HIGH = 0
+NORMAL = 1
+LOW = 2
 
-  p = subprocess.Popen(["powershell.exe", 
-                "Add-Type -AssemblyName System.speech; $speak = New-Object System.Speech.Synthesis.SpeechSynthesizer; $speak.SelectVoice('%s'); $speak.Speak('%s')" % (voice, speech)], 
-                stdout=sys.stdout)
-  p.communicate()
+# Reads an action, a voice and a text line from stdin for each utterance, so one
+# process and one synthesizer serve every phrase and no quoting is needed.
+# 'render' answers with the WAV audio in base64 instead of playing it.
+powershell_script = '''
+Add-Type -AssemblyName System.speech
+$speak = New-Object System.Speech.Synthesis.SpeechSynthesizer
+while ($true) {
+  $action = [Console]::In.ReadLine()
+  $voice = [Console]::In.ReadLine()
+  $text = [Console]::In.ReadLine()
+  if ($text -eq $null) { break }
+  $speak.SelectVoice($voice)
+  if ($action -eq 'render') {
+    $stream = New-Object System.IO.MemoryStream
+    $speak.SetOutputToWaveStream($stream)
+    $speak.Speak($text)
+    $speak.SetOutputToDefaultAudioDevice()
+    [Console]::Out.WriteLine([Convert]::ToBase64String($stream.ToArray()))
+  } else {
+    $speak.Speak($text)
+    [Console]::Out.WriteLine('done')
+  }
+  [Console]::Out.Flush()
+}
+'''
 
-def mspeak(speech):
-  speak(MALE, speech)
+class PowerShellBackend:
+  '''Windows System.Speech in one long-lived PowerShell process. Stopping
+     the current utterance kills the process; the next one starts a new one.'''
 
-def fspeak(speech):
-  speak(FEMALE, speech)
\ No newline at end of file
+  def __init__(self):
+    self.process = None
+
+  def start(self):
+    self.process = subprocess.Popen(['powershell.exe', '-NoProfile', '-NonInteractive', '-Command', powershell_script],
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+
+  def request(self, action, voice, text):
+    if self.process is None or self.process.poll() is not None:
+      self.start()
+    process = self.process
+    process.stdin.write('%s\n%s\n%s\n' % (action, voice, ' '.join(text.splitlines())))
+    process.stdin.flush()
+    reply = process.stdout.readline()
+    if reply == '':
+      self.process = None
+    return reply.strip()
+
+  def speak(self, voice, text):
+    self.request('speak', voice, text)
+
+  def render(self, voice, text):
+    return base64.b64decode(self.request('render', voice, text))
+
+  def stop(self):
+    process = self.process
+    self.process = None
+    if process is not None:
+      process.kill()
+
+class EspeakBackend:
+  '''Offline speech on Linux with espeak-ng. It starts in a few milliseconds,
+     so each utterance gets its own process, which also makes stopping one easy.'''
+
+  voices = {MALE: 'en-gb+m3', FEMALE: 'en-gb+f3'}
+
+  def __init__(self, command='espeak-ng'):
+    self.command = command
+    # Guards process, so stop() always sees one that has been started
+    self.lock = threading.Lock()
+    self.process = None
+
+  def run(self, voice, text, options=(), stdout=None):
+    # '--' so text starting with '-' is not read as an option
+    args = [self.command, '-v', self.voices.get(voice, voice)] + list(options) + ['--', text]
+    with self.lock:
+      process = self.process = subprocess.Popen(args, stdout=stdout)
+    try:
+      output, _ = process.communicate()
+    finally:
+      with self.lock:
+        if self.process is process:
+          self.process = None
+    if process.returncode < 0:
+      # Stopped
+      return b''
+    if process.returncode != 0:
+      raise subprocess.CalledProcessError(process.returncode, args)
+    return output
+
+  def speak(self, voice, text):
+    self.run(voice, text)
+
+  def render(self, voice, text):
+    return self.run(voice, text, ['--stdout'], subprocess.PIPE)
+
+  def stop(self):
+    with self.lock:
+      process = self.process
+      if process is not None and process.poll() is None:
+        process.terminate()
+
+def default_backend():
+  if sys.platform == 'win32':
+    return PowerShellBackend()
+  return EspeakBackend()
+
+class MixerPlayer:
+  '''Plays rendered speech through the sound_engine mixer'''
+
+  def play(self, data):
+    sound_engine.play_speech(data)
+
+  def stop(self):
+    sound_engine.stop_speech()
+
+class AudioCache:
+  '''Rendered speech, keyed by a hash of (voice, text). Holds at most
+     max_bytes of audio, evicting the least recently played first.'''
+
+  def __init__(self, max_bytes=64 * 1024 * 1024):
+    self.max_bytes = max_bytes
+    self.size = 0
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def key(self, voice, text):
+    return hashlib.sha1(('%s\n%s' % (voice, text)).encode('utf-8')).hexdigest()
+
+  def __contains__(self, voice_text):
+    with self.lock:
+      return self.key(*voice_text) in self.entries
+
+  def get(self, voice, text):
+    key = self.key(voice, text)
+    with self.lock:
+      data = self.entries.get(key)
+      if data is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+      self.entries.move_to_end(key)
+      return data
+
+  def put(self, voice, text, data):
+    if len(data) > self.max_bytes:
+      return
+    key = self.key(voice, text)
+    with self.lock:
+      if key in self.entries:
+        self.size -= len(self.entries.pop(key))
+      self.entries[key] = data
+      self.size += len(data)
+      while self.size > self.max_bytes:
+        evicted_key, evicted = self.entries.popitem(last=False)
+        self.size -= len(evicted)
+        self.evictions += 1
+
+class Utterance:
+
+  def __init__(self, voice, text, priority):
+    self.voice = voice
+    self.text = text
+    self.priority = priority
+    self.cancelled = False
+    # The backend speaking or rendering it right now, if any
+    self.backend = None
+    self.queued_at = time.time()
+    self.done = threading.Event()
+
+class SpeechScheduler:
+  '''The one place speech is queued, spoken one utterance at a time on a
+     single thread. Lower priority values go first, and equal priorities in
+     the order they were queued. Callers never wait; say returns the
+     Utterance, which can be cancelled whether it is still queued or already
+     being spoken.
+
+     Saying something that is already queued returns the queued utterance
+     instead of adding another. At most max_pending utterances wait; beyond
+     that the least urgent is dropped. An utterance at barge_in_priority or
+     above interrupts less urgent speech already in progress.
+
+     Speech goes to the default backend unless its voice has its own backend
+     (add_backend). With a cache and player, default backend speech is
+     rendered once into the cache and played from there.'''
+
+  samples = 100
+
+  def __init__(self, backend, cache=None, player=None, max_pending=8, barge_in_priority=HIGH):
+    self.backend = backend
+    self.backends = {}
+    self.cache = cache
+    self.player = player
+    self.max_pending = max_pending
+    self.barge_in_priority = barge_in_priority
+    self.queue = queue.PriorityQueue()
+    self.sequence = itertools.count()
+    self.lock = threading.Lock()
+    # (voice, text) -> queued utterance
+    self.pending = {}
+    self.current = None
+
+    self.queue_waits = deque(maxlen=self.samples)
+    self.speak_durations = deque(maxlen=self.samples)
+    self.spoken = 0
+    self.deduplicated = 0
+    self.dropped = 0
+    self.interrupted = 0
+
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def add_backend(self, voice, backend):
+    self.backends[voice] = backend
+
+  def say(self, voice, text, priority=NORMAL):
+    with self.lock:
+      key = (voice, text)
+      queued = self.pending.get(key)
+      if queued is not None:
+        if queued.priority <= priority:
+          self.deduplicated += 1
+          return queued
+        # Asked for again more urgently; queue it again at the new priority
+        self.cancel_pending(queued)
+
+      utterance = Utterance(voice, text, priority)
+      if len(self.pending) >= self.max_pending:
+        least_urgent = max(self.pending.values(), key=lambda u: (u.priority, u.queued_at))
+        self.dropped += 1
+        if least_urgent.priority <= priority:
+          utterance.cancelled = True
+          utterance.done.set()
+          return utterance
+        self.cancel_pending(least_urgent)
+
+      self.pending[key] = utterance
+      self.queue.put((priority, next(self.sequence), utterance))
+
+      current = self.current
+      if current is not None and priority <= self.barge_in_priority and priority < current.priority:
+        self.interrupted += 1
+        self.stop_current(current)
+    return utterance
+
+  def cancel_pending(self, utterance):
+    # Needs the lock. Cancelled utterances stay in the queue and are skipped.
+    utterance.cancelled = True
+    utterance.done.set()
+    if self.pending.get((utterance.voice, utterance.text)) is utterance:
+      del self.pending[(utterance.voice, utterance.text)]
+
+  def stop_current(self, utterance):
+    # Needs the lock
+    utterance.cancelled = True
+    # Cached audio only needs the player stopped; stopping the backend would
+    # throw away its warm synthesizer
+    if utterance.backend is not None:
+      utterance.backend.stop()
+    if self.player is not None:
+      self.player.stop()
+
+  def cancel(self, utterance):
+    with self.lock:
+      if self.current is utterance:
+        self.stop_current(utterance)
+      else:
+        self.cancel_pending(utterance)
+
+  def cancel_all(self):
+    with self.lock:
+      for utterance in list(self.pending.values()):
+        self.cancel_pending(utterance)
+      if self.current is not None:
+        self.stop_current(self.current)
+
+  def stop(self):
+    self.cancel_all()
+    # Sorts ahead of every utterance
+    self.queue.put((HIGH - 1, next(self.sequence), None))
+
+  def stats(self):
+    def summary(samples):
+      samples = list(samples)
+      if not samples:
+        return {'mean': 0, 'max': 0}
+      return {'mean': sum(samples) / len(samples), 'max': max(samples)}
+    with self.lock:
+      return {'queue_wait': summary(self.queue_waits), 'speak_duration': summary(self.speak_durations),
+              'pending': len(self.pending), 'spoken': self.spoken, 'deduplicated': self.deduplicated,
+              'dropped': self.dropped, 'interrupted': self.interrupted}
+
+  def run(self):
+    while True:
+      priority, sequence, utterance = self.queue.get()
+      if utterance is None:
+        break
+      with self.lock:
+        if utterance.cancelled:
+          continue
+        if self.pending.get((utterance.voice, utterance.text)) is utterance:
+          del self.pending[(utterance.voice, utterance.text)]
+        self.current = utterance
+        started = time.time()
+        self.queue_waits.append(started - utterance.queued_at)
+      try:
+        self.speak(utterance)
+      except Exception as e:
+        logging.error('Unable to speak: %s' % e)
+      finally:
+        with self.lock:
+          self.current = None
+          self.speak_durations.append(time.time() - started)
+          self.spoken += 1
+        utterance.done.set()
+
+  def use_backend(self, utterance, backend):
+    # Returns False if the utterance has been stopped already
+    with self.lock:
+      utterance.backend = backend
+      return not utterance.cancelled
+
+  def speak(self, utterance):
+    backend = self.backends.get(utterance.voice)
+    if backend is not None or self.cache is None or self.player is None:
+      backend = backend or self.backend
+      if self.use_backend(utterance, backend):
+        backend.speak(utterance.voice, utterance.text)
+      return
+    data = self.cache.get(utterance.voice, utterance.text)
+    if data is None:
+      if not self.use_backend(utterance, self.backend):
+        return
+      data = self.backend.render(utterance.voice, utterance.text)
+      self.use_backend(utterance, None)
+      if not data:
+        # Stopped while rendering
+        return
+      self.cache.put(utterance.voice, utterance.text, data)
+    if not utterance.cancelled:
+      self.player.play(data)
+
+cache = AudioCache()
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def get_scheduler():
+  global scheduler
+  with scheduler_lock:
+    if scheduler is None:
+      scheduler = SpeechScheduler(default_backend(), cache, MixerPlayer())
+    return scheduler
+
+def prewarm(lines):
+  '''Renders (voice, text) lines missing from the cache on a background thread,
+     with its own backend so queued speech is not held up'''
+  def render_all():
+    backend = default_backend()
+    for voice, text in lines:
+      if (voice, text) in cache:
+        continue
+      try:
+        data = backend.render(voice, text)
+        if data:
+          cache.put(voice, text, data)
+      except Exception as e:
+        logging.error('Unable to render speech: %s' % e)
+    backend.stop()
+  thread = threading.Thread(target=render_all)
+  thread.daemon = True
+  thread.start()
+  return thread
+
+def add_backend(voice, backend):
+  get_scheduler().add_backend(voice, backend)
+
+def speak(voice, speech, priority=NORMAL):
+  return get_scheduler().say(voice, str(speech), priority)
+
+def mspeak(speech, priority=NORMAL):
+  return speak(MALE, speech, priority)
+
+def fspeak(speech, priority=NORMAL):
+  return speak(FEMALE, speech, priority)
+
+def cancel_all():
+  get_scheduler().cancel_all()
+
+def stats():
+  return get_scheduler().stats()
+
+def stop():
+  if scheduler is not None:
+    scheduler.stop()
\ No newline at end of file